@@ -32,7 +32,7 @@ CELERY_APP = Celery("TRAFFIC-STUCK-TASKS", broker=APP_CONFIG.CACHE_REDIS_URL)
 CELERY_APP.conf.beat_schedule = {
     "collect_gtfs": {
         "task": "app.tasks.collect_traffic",
-        "schedule": crontab(minute="*/5"),
+        "schedule": APP_CONFIG.TRAFFIC_POLL_INTERVAL or crontab(minute="*/5"),
     },
     "prepare_static": {
         "task": "app.tasks.prepare_easyway_static",
@@ -45,6 +45,10 @@ CELERY_APP.conf.beat_schedule = {
     "dump_traffic": {
         "task": "app.tasks.dump_traffic",
         "schedule": crontab(minute=15, hour=3, day_of_week=1)
+    },
+    "apply_traffic_retention": {
+        "task": "app.tasks.apply_traffic_retention",
+        "schedule": crontab(minute=45, hour=4)
     }
 }
 CELERY_APP.conf.timezone = "Europe/Kiev"
@@ -4,3 +4,18 @@
 REDIS_API_PREFIX = "API"
 REDIS_ROUTES_MIN_SPEED_KEY = f"{REDIS_API_PREFIX}:ROUTES_MIN_SPEED"
 REDIS_GTFS_ODOMETERS_KEY_KEY = f"{REDIS_API_PREFIX}:GTFS_ODOMETERS"
+REDIS_STATIC_VERSION_KEY = f"{REDIS_API_PREFIX}:STATIC_VERSION"
+REDIS_TRAFFIC_VERSION_KEY = f"{REDIS_API_PREFIX}:TRAFFIC_VERSION"
+REDIS_CACHE_PREFIX = f"{REDIS_API_PREFIX}:CACHE"
+REDIS_CACHE_METRICS_KEY = f"{REDIS_API_PREFIX}:CACHE_METRICS"
+REDIS_TRAFFIC_LATEST_KEY = f"{REDIS_API_PREFIX}:TRAFFIC_LATEST"
+REDIS_TRAFFIC_HISTORY_PREFIX = f"{REDIS_API_PREFIX}:TRAFFIC_HISTORY"
+REDIS_GTFS_POSITIONS_KEY = f"{REDIS_API_PREFIX}:GTFS_POSITIONS"
+REDIS_TRAFFIC_STREAM_KEY = f"{REDIS_API_PREFIX}:TRAFFIC_STREAM"
+REDIS_GTFS_FEED_STATE_KEY = f"{REDIS_API_PREFIX}:GTFS_FEED_STATE"
+REDIS_SPEED_HISTOGRAM_KEY = f"{REDIS_API_PREFIX}:SPEED_HISTOGRAM"
+REDIS_ROUTES_CONGESTION_KEY = f"{REDIS_API_PREFIX}:ROUTES_CONGESTION"
+REDIS_SEGMENTS_CONGESTION_KEY = f"{REDIS_API_PREFIX}:SEGMENTS_CONGESTION"
+REDIS_ROUTES_BASELINE_KEY = f"{REDIS_API_PREFIX}:ROUTES_BASELINE"
+REDIS_SEGMENTS_BASELINE_KEY = f"{REDIS_API_PREFIX}:SEGMENTS_BASELINE"
+REDIS_STOPS_PREDICTIONS_KEY = f"{REDIS_API_PREFIX}:STOPS_PREDICTIONS"
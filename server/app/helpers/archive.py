@@ -0,0 +1,86 @@
+"""This module provides streaming export of traffic archives."""
+
+import os
+import gzip
+import json
+import shutil
+import logging
+import tempfile
+
+from app import APP_CONFIG
+from app.helpers.google_drive import GoogleDrive
+
+
+LOGGER = logging.getLogger(__name__)
+
+ARCHIVE_MIMETYPE = "application/gzip"
+ARCHIVE_EXTENSION = "ndjson.gz"
+ARCHIVE_SPOOL_SIZE = 8 * 1024 * 1024  # 8 MB kept in memory before spilling to disk
+ARCHIVE_COMPRESS_LEVEL = 6
+
+
+def write_ndjson(documents, fileobj):
+    """Write documents as gzip compressed newline delimited json, return documents count."""
+    count = 0
+    with gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=ARCHIVE_COMPRESS_LEVEL) as archive:
+        for document in documents:
+            archive.write(json.dumps(document, ensure_ascii=False).encode("utf-8"))
+            archive.write(b"\n")
+            count += 1
+
+    fileobj.seek(0)
+    return count
+
+
+def spool_ndjson(documents):
+    """Return spooled temporary file with compressed documents and documents count."""
+    fileobj = tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_SIZE)
+    try:
+        count = write_ndjson(documents, fileobj)
+    except Exception:
+        fileobj.close()
+        raise
+
+    return fileobj, count
+
+
+class GoogleDriveBackend:
+    """Archive backend that uploads files into google drive directory."""
+
+    def __init__(self, directory_id):
+        self.directory_id = directory_id
+
+    def upload(self, name, fileobj, mimetype):
+        """Upload file in resumable chunks, return google drive file id."""
+        return GoogleDrive.upload_file(name, self.directory_id, fileobj, mimetype)
+
+
+class LocalDirectoryBackend:
+    """Archive backend that copies files into local directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def upload(self, name, fileobj, mimetype):
+        """Copy file into local directory, return path of the copied file."""
+        path = os.path.join(self.directory, name)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "wb") as file:
+                shutil.copyfileobj(fileobj, file)
+        except OSError as err:
+            LOGGER.error("Failed to store archive %s (%s): %s", name, mimetype, err)
+            return None
+
+        return path
+
+
+ARCHIVE_BACKENDS = {
+    "google_drive": lambda: GoogleDriveBackend(APP_CONFIG.GOOGLE_DRIVE_DIRECTORY_ID),
+    "local": lambda: LocalDirectoryBackend(APP_CONFIG.TRAFFIC_ARCHIVE_DIR),
+}
+
+
+def get_archive_backend():
+    """Return archive backend configured by settings."""
+    return ARCHIVE_BACKENDS[APP_CONFIG.TRAFFIC_ARCHIVE_BACKEND]()
@@ -0,0 +1,164 @@
+"""This module provides in-memory prefix and fuzzy autocomplete over stops names."""
+
+import re
+import time
+import bisect
+import logging
+import unicodedata
+
+import numpy as np
+
+
+LOGGER = logging.getLogger(__name__)
+
+TRANSLITERATION = {
+    "а": "a", "б": "b", "в": "v", "г": "h", "ґ": "g", "д": "d", "е": "e", "є": "ie",
+    "ж": "zh", "з": "z", "и": "y", "і": "i", "ї": "i", "й": "i", "к": "k", "л": "l",
+    "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch", "ь": "", "ю": "iu",
+    "я": "ia", "ы": "y", "э": "e", "ё": "e", "ъ": "",
+}
+TRANSLITERATION_TABLE = str.maketrans(TRANSLITERATION)
+# letters spelled differently by popular transliterations are folded to single
+# skeleton: х as h/kh, г as h/g, и/й/ї/і as y/i/yi/j, doubled letters as single
+FOLDING = {"kh": "h", "g": "h", "y": "i", "j": "i"}
+FOLDING_RE = re.compile("|".join(sorted(FOLDING, key=len, reverse=True)))
+DOUBLES_RE = re.compile(r"([a-z])\1+")
+APOSTROPHES_RE = re.compile(r"['’ʼ`]")
+SEPARATORS_RE = re.compile(r"[^\w]+|_")
+
+PREFIX_SENTINEL = "\uffff"
+NAME_FIELDS = (("stop_name", 0), ("stop_desc", 1))
+FUZZY_MIN_SIMILARITY = 0.5  # share of query trigrams found in the name
+FUZZY_NGRAM = 3
+
+
+def normalize(text):
+    """
+    Return lowercase latin words of text transliterated from ukrainian
+    cyrillic and folded, so names and queries typed in any common
+    transliteration get the same words.
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = APOSTROPHES_RE.sub("", text).translate(TRANSLITERATION_TABLE)
+    text = DOUBLES_RE.sub(r"\1", FOLDING_RE.sub(lambda x: FOLDING[x.group()], text))
+    return SEPARATORS_RE.sub(" ", text).split()
+
+
+def get_ngrams(text):
+    """Return set of character n-grams of text padded by spaces."""
+    text = f" {text} "
+    return {text[i:i + FUZZY_NGRAM] for i in range(len(text) - FUZZY_NGRAM + 1)}
+
+
+class StopAutocomplete:
+    """
+    Autocomplete index over stops names and descriptions. Every word of
+    normalized names is stored in sorted array, so words by prefix are found
+    by binary search. Queries without prefix matches fall back to trigram
+    similarity over inverted index of names trigrams.
+    """
+
+    def __init__(self, stops):
+        started = time.perf_counter()
+        self.stops = stops
+        self.words = []
+        self.lengths = []
+        keys = []
+        for index, stop in enumerate(stops):
+            stop_words = []
+            for field, rank in NAME_FIELDS:
+                words = normalize(stop.get(field))
+                for position, word in enumerate(words):
+                    # name start ranks above inner words, names above descriptions
+                    keys.append((word, rank * 2 + bool(position), index))
+                stop_words.extend(words)
+
+            self.words.append(stop_words)
+            self.lengths.append(len(stop.get("stop_name") or ""))
+
+        keys.sort()
+        self.lengths = np.array(self.lengths, dtype=np.int64)
+        self.keys = [key for key, _, _ in keys]
+        self.keys_ranks = np.array([rank for _, rank, _ in keys], dtype=np.int8)
+        self.keys_stops = np.array([index for _, _, index in keys], dtype=np.int64)
+
+        ngrams = {}
+        self.ngrams_counts = np.zeros(len(stops), dtype=np.int64)
+        for index, stop_words in enumerate(self.words):
+            stop_ngrams = get_ngrams(" ".join(stop_words))
+            self.ngrams_counts[index] = len(stop_ngrams)
+            for ngram in stop_ngrams:
+                ngrams.setdefault(ngram, []).append(index)
+        self.ngrams = {k: np.array(v, dtype=np.int64) for k, v in ngrams.items()}
+
+        self.build_time = time.perf_counter() - started
+        LOGGER.info(
+            "Built stops autocomplete with %s keys and %s trigrams in %.1f ms.",
+            len(self.keys), len(self.ngrams), self.build_time * 1000
+        )
+
+    def __len__(self):
+        return len(self.stops)
+
+    def search_prefix(self, words, limit):
+        """
+        Return stops indexes found by the first query word prefix whose words
+        start with every other query word in any order.
+        """
+        start = bisect.bisect_left(self.keys, words[0])
+        end = bisect.bisect_left(self.keys, words[0] + PREFIX_SENTINEL, start)
+        stops = self.keys_stops[start:end]
+        ranks = self.keys_ranks[start:end]
+        order = np.lexsort((stops, self.lengths[stops], ranks))
+
+        found = []
+        seen = set()
+        for index in stops[order].tolist():
+            if index in seen:
+                continue
+
+            seen.add(index)
+            stop_words = self.words[index]
+            if all(any(x.startswith(word) for x in stop_words) for word in words[1:]):
+                found.append(index)
+                if len(found) == limit:
+                    break
+
+        return found
+
+    def search_fuzzy(self, words, limit):
+        """
+        Return stops indexes with the most query trigrams in names, names
+        with the higher jaccard similarity to the query are ranked first.
+        """
+        query_ngrams = get_ngrams(" ".join(words))
+        postings = [self.ngrams[x] for x in query_ngrams if x in self.ngrams]
+        if not postings:
+            return []
+
+        matches = np.bincount(np.concatenate(postings), minlength=len(self))
+        containment = matches / len(query_ngrams)
+        jaccard = matches / (len(query_ngrams) + self.ngrams_counts - matches)
+        candidates = np.flatnonzero(containment >= FUZZY_MIN_SIMILARITY)
+        order = np.lexsort((-jaccard[candidates], -containment[candidates]))[:limit]
+        return candidates[order].tolist()
+
+    def search(self, query, limit):
+        """Return stops matching query by words prefixes or by similarity."""
+        started = time.perf_counter()
+        words = normalize(query)
+        if not words or limit <= 0:
+            return []
+
+        found = self.search_prefix(words, limit)
+        method = "prefix"
+        if not found:
+            found = self.search_fuzzy(words, limit)
+            method = "fuzzy"
+
+        LOGGER.debug(
+            "Autocomplete (%s) found %s stops by %s in %.3f ms.",
+            query, len(found), method, (time.perf_counter() - started) * 1000
+        )
+        return [self.stops[index] for index in found]
@@ -0,0 +1,203 @@
+"""This module provides per route and per road segment traffic congestion."""
+
+import json
+import logging
+
+import numpy as np
+from redis.exceptions import RedisError
+
+from app import REDIS
+from app.constants import (
+    REDIS_ROUTES_CONGESTION_KEY,
+    REDIS_SEGMENTS_CONGESTION_KEY,
+    REDIS_ROUTES_BASELINE_KEY,
+    REDIS_SEGMENTS_BASELINE_KEY
+)
+from app.helpers.outliers import grouped_quantiles, mad_mask
+
+
+LOGGER = logging.getLogger(__name__)
+
+BASELINE_QUANTILE = 0.85  # free flow speed is the 85th percentile of moving vehicles speeds
+BASELINE_ALPHA = 0.05  # weight of the current tick in exponentially smoothed baseline
+CONGESTION_TIMEOUT = 900  # 15 min, stale congestion disappears when collection stops
+
+
+def get_groups_speeds(codes, speeds, size):
+    """
+    Return vehicles count, avg speed and free flow speed of moving vehicles
+    per group. Speed glitches are dropped by median absolute deviation of
+    vehicles speeds within their group before aggregation.
+    """
+    moving = (codes >= 0) & (speeds > 0)
+    codes, speeds = codes[moving], speeds[moving]
+    inliers = mad_mask(speeds, groups=codes)
+    codes, speeds = codes[inliers], speeds[inliers]
+    counts = np.bincount(codes, minlength=size)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg_speeds = np.bincount(codes, weights=speeds, minlength=size) / counts
+
+    free_flow_speeds = grouped_quantiles(speeds, codes, BASELINE_QUANTILE, minlength=size)
+    return counts, avg_speeds, free_flow_speeds
+
+
+def update_baselines(key, names, free_flow_speeds):
+    """Smooth stored speed baselines with the current free flow speeds, return baselines."""
+    stored = REDIS.hmget(key, names)
+    baselines = np.array([float(x) if x else np.nan for x in stored], dtype=np.float64)
+    baselines = np.where(
+        np.isnan(baselines),
+        free_flow_speeds,
+        (1 - BASELINE_ALPHA) * baselines + BASELINE_ALPHA * free_flow_speeds
+    )
+    REDIS.hset(key, mapping={
+        name: round(float(baseline), 2)
+        for name, baseline in zip(names, baselines) if not np.isnan(baseline)
+    })
+    return baselines
+
+
+def get_congestions(avg_speeds, baselines):
+    """Return congestion percent: how much slower vehicles move than the baseline."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        congestions = 100 * np.clip(1 - avg_speeds / baselines, 0, 1)
+
+    return np.round(congestions, 1)
+
+
+def load_congestion(key):
+    """Return stored congestion tick or None."""
+    try:
+        congestion = REDIS.get(key)
+    except RedisError as err:
+        LOGGER.error("Couldn't retrieve congestion (%s): %s", key, err)
+        return None
+
+    return json.loads(congestion) if congestion else {"timestamp": None, "values": {}}
+
+
+class RoutesCongestion:
+    """
+    Class that provides methods to work with congestion per route. Every
+    tick is stored as single compact json: route name mapped to
+    [congestion, avg speed, baseline speed, vehicles count].
+    """
+
+    @staticmethod
+    def update(traffic):
+        """Calculate and store congestion of every route in collected traffic batch."""
+        names = list(dict.fromkeys(route_short_name for _, route_short_name, _ in traffic.routes))
+        names_codes = {name: code for code, name in enumerate(names)}
+        codes = np.array([names_codes[x[1]] for x in traffic.routes], dtype=np.int64)[traffic.route_codes]
+
+        counts, avg_speeds, free_flow_speeds = get_groups_speeds(codes, traffic.speeds, len(names))
+        present = np.flatnonzero((counts > 0) & np.array([bool(x) for x in names], dtype=bool))
+        if not present.size:
+            return 0
+
+        names = [names[x] for x in present]
+        baselines = update_baselines(REDIS_ROUTES_BASELINE_KEY, names, free_flow_speeds[present])
+        congestions = get_congestions(avg_speeds[present], baselines)
+
+        values = {
+            name: [float(congestion), round(float(speed), 1), round(float(baseline), 1), int(count)]
+            for name, congestion, speed, baseline, count
+            in zip(names, congestions, avg_speeds[present], baselines, counts[present])
+        }
+        congestion = json.dumps({"timestamp": traffic.timestamp, "values": values}, ensure_ascii=False)
+        REDIS.set(REDIS_ROUTES_CONGESTION_KEY, congestion, CONGESTION_TIMEOUT)
+        return len(values)
+
+    @staticmethod
+    def get(route=None):
+        """Return latest routes congestion sorted from the most congested route."""
+        congestion = load_congestion(REDIS_ROUTES_CONGESTION_KEY)
+        if congestion is None:
+            return None
+
+        routes = [
+            {
+                "route": name,
+                "congestion": value[0],
+                "avg_speed": value[1],
+                "baseline_speed": value[2],
+                "vehicles": value[3]
+            }
+            for name, value in congestion["values"].items()
+            if route is None or name == route
+        ]
+        routes.sort(key=lambda x: -x["congestion"])
+        return {"timestamp": congestion["timestamp"], "routes": routes}
+
+
+class SegmentsCongestion:
+    """
+    Class that provides methods to work with congestion per road segment
+    between two stops. Vehicles are snapped to segments served by their
+    route and every tick is stored as single compact json: segment id
+    mapped to [congestion, avg speed, baseline speed, vehicles count].
+    """
+
+    @staticmethod
+    def update(traffic, index):
+        """Snap vehicles of collected traffic batch to segments and store segments congestion."""
+        route_ids = [traffic.routes[x][0] for x in traffic.route_codes.tolist()]
+        snapped = index.snap(traffic.latitudes, traffic.longitudes, route_ids)
+
+        counts, avg_speeds, free_flow_speeds = get_groups_speeds(snapped, traffic.speeds, len(index))
+        present = np.flatnonzero(counts)
+        if not present.size:
+            return 0
+
+        segment_ids = [index.ids[x] for x in present.tolist()]
+        baselines = update_baselines(REDIS_SEGMENTS_BASELINE_KEY, segment_ids, free_flow_speeds[present])
+        congestions = get_congestions(avg_speeds[present], baselines)
+
+        values = {
+            segment_id: [float(congestion), round(float(speed), 1), round(float(baseline), 1), int(count)]
+            for segment_id, congestion, speed, baseline, count
+            in zip(segment_ids, congestions, avg_speeds[present], baselines, counts[present])
+        }
+        congestion = json.dumps({"timestamp": traffic.timestamp, "values": values})
+        REDIS.set(REDIS_SEGMENTS_CONGESTION_KEY, congestion, CONGESTION_TIMEOUT)
+        return len(values)
+
+    @staticmethod
+    def get(index, route=None, bbox=None):
+        """Return latest segments congestion with geometry filtered by route and bounding box."""
+        congestion = load_congestion(REDIS_SEGMENTS_CONGESTION_KEY)
+        if congestion is None:
+            return None
+
+        segments = []
+        for segment_id, value in congestion["values"].items():
+            position = index.positions.get(segment_id)
+            if position is None:
+                continue
+
+            segment = index.segments[position]
+            if route and route not in segment["route_names"]:
+                continue
+
+            if bbox:
+                min_latitude, min_longitude, max_latitude, max_longitude = bbox
+                if not any(
+                    min_latitude <= latitude <= max_latitude and min_longitude <= longitude <= max_longitude
+                    for latitude, longitude in segment["coordinates"]
+                ):
+                    continue
+
+            segments.append({
+                "id": segment_id,
+                "from_stop_id": segment["from_stop_id"],
+                "to_stop_id": segment["to_stop_id"],
+                "route_names": segment["route_names"],
+                "coordinates": segment["coordinates"],
+                "congestion": value[0],
+                "avg_speed": value[1],
+                "baseline_speed": value[2],
+                "vehicles": value[3]
+            })
+
+        segments.sort(key=lambda x: -x["congestion"])
+        return {"timestamp": congestion["timestamp"], "segments": segments}
@@ -1,37 +1,40 @@
 """This module provides helper functionality to work with easyway data."""
 
-import re
+import array
 import collections
-from datetime import datetime
 
+import numpy as np
 from google import protobuf
 from google.transit import gtfs_realtime_pb2
-from shapely.geometry import Point
 
-from app.utils.misc import load_csv
-from app.utils.time import get_time_integer
-from app.helpers.traffic import Traffic
+from app.utils.misc import iter_zip_csv
+from app.utils.time import get_time_integer, get_expire_at
+from app.helpers.traffic import CONGESTION_RETENTION, Traffic
+from app.helpers.segments import get_segment_id
+from app.helpers.stops import pack_arrivals
+from app.helpers.traffic_batch import TrafficBatch
 from app.helpers.easyway_static import (
-    STATIC_STOP_TIMES_FILE,
+    STATIC_ZIP_FILE,
+    STATIC_STOP_TIMES_NAME,
+    get_snapshot,
     get_routes_names,
-    get_regions_bounds,
+    get_routes_types,
+    get_regions_classifier,
     get_routes_trips,
     get_routes,
     get_trips,
-    get_stops
+    get_trips_services,
+    get_services_dates
 )
 
 
-ROUTE_TYPE_MAP = {
-    "А": "Автобус",
-    "Н-А": "Нічний Автобус",
-    "Т": "Трамвай",
-    "Тр": "Тролейбус"
-}
+StopsArrivals = collections.namedtuple("StopsArrivals", ["route_names", "service_ids", "trip_ids", "arrivals"])
+TripsStops = collections.namedtuple("TripsStops", ["stop_ids", "trips"])
+TripCodes = collections.namedtuple("TripCodes", ["route_id", "route_code", "service_code", "trip_code"])
 
 
-def parse_traffic(gtfs, timestamp, prev_odometers):
-    """Compile and parse GTFS data using protobuf to dictionary format."""
+def decode_feed(gtfs):
+    """Return GTFS realtime feed message decoded using protobuf."""
     feed = gtfs_realtime_pb2.FeedMessage()
 
     try:
@@ -39,95 +42,47 @@ def parse_traffic(gtfs, timestamp, prev_odometers):
     except protobuf.message.DecodeError:
         return None
 
-    traffic = []
-    route_type_re = re.compile(r"\d+")
-    route_names = get_routes_names()
-    for entity in feed.entity:
-        vehicle = entity.vehicle
-        position = vehicle.position
-        route_id = vehicle.trip.route_id
-        license_plate = vehicle.vehicle.license_plate.replace("-", "")
-
-        route_short_name = route_names.get(route_id, "")
-        route_type_short = re.sub(route_type_re, "", route_short_name)
-        route_type = ROUTE_TYPE_MAP.get(route_type_short, "Інші")
-        prev_odometer = prev_odometers.get(vehicle.vehicle.id, position.odometer)
-
-        traffic.append({
-            "route_id": route_id,
-            "route_short_name": route_short_name,
-            "route_type": route_type,
-
-            "trip_latitude": position.latitude,
-            "trip_longitude": position.longitude,
-            "trip_vehicle_id": vehicle.vehicle.id,
-            "trip_license_plate": license_plate,
-            "trip_bearing": position.bearing,
-            "trip_speed": position.speed * 3.6,
-            "trip_odometer": position.odometer,
-            "trip_distance": position.odometer - prev_odometer,
+    return feed
 
-            "timestamp": timestamp,
-            "date": datetime.now().isoformat()
-        })
 
-    return traffic
+def parse_traffic(feed, timestamp, prev_odometers):
+    """Compile GTFS realtime feed message to columnar traffic batch."""
+    return TrafficBatch.from_feed(
+        feed,
+        timestamp,
+        prev_odometers,
+        routes_names=get_routes_names(),
+        routes_types=get_routes_types()
+    )
 
 
 def parse_traffic_congestion(traffic, timestamp):
     """Return parsed traffic congestion by regions."""
-    regions_speeds = collections.defaultdict(list)
-    regions_polygons = get_regions_bounds()
-    for route in traffic:
-        trip_speed = route["trip_speed"]
-        point = Point((route["trip_latitude"], route["trip_longitude"]))
-        for name, poly in regions_polygons.items():
-            if poly.contains(point):
-                regions_speeds[name].append(trip_speed)
+    classifier = get_regions_classifier()
+    points, regions = classifier.classify(traffic.latitudes, traffic.longitudes)
+    speeds = traffic.speeds[points]
+    moving = speeds != 0
+    regions_counts = np.bincount(regions[moving], minlength=len(classifier))
+    regions_speeds = np.bincount(regions[moving], weights=speeds[moving], minlength=len(classifier))
 
-    traffic_congestions = []
     min_speed = Traffic.get_routes_min_speed()
-    for region, region_speeds in regions_speeds.items():
-        region_speeds = list(filter(lambda x: x != 0, region_speeds))
-        try:
-            region_avg_speed = sum(region_speeds) / len(region_speeds)
-            region_congestion = (100 * min_speed) / region_avg_speed
-        except (ZeroDivisionError, TypeError):
-            continue
-        else:
-            traffic_congestions.append({
-                "id": region,
-                "value": region_congestion,
-                "timestamp": timestamp
-            })
-
-    return traffic_congestions
-
-
-def get_stops_per_routes():
-    """Return dict with data about count of stops per routes."""
-    routes_trips = get_routes_trips()
-    routes_names = get_routes_names()
-
-    trips_map = {}
-    for route, trips in routes_trips.items():
-        trips_map.update({trip: route for trip in trips})
+    if min_speed is None:
+        return []
 
-    stops = set()
-    stop_times = load_csv(STATIC_STOP_TIMES_FILE)
-    for stop_time in stop_times:
-        trip_id = stop_time["trip_id"].split("_")[0]
-        stop_id = stop_time["stop_id"]
-        route_id = trips_map[trip_id]
-        route_name = routes_names[route_id]
-        stops.add((route_name, stop_id))
+    traffic_congestions = []
+    for index in np.flatnonzero(regions_counts):
+        region_avg_speed = regions_speeds[index] / regions_counts[index]
+        if not region_avg_speed:
+            continue
 
-    routes = dict.fromkeys(routes_names.values(), 0)
-    for route_name, stop_id in stops:
-        routes[route_name] += 1
+        traffic_congestions.append({
+            "id": classifier.names[index],
+            "value": float((100 * min_speed) / region_avg_speed),
+            "timestamp": timestamp,
+            "expire_at": get_expire_at(timestamp, CONGESTION_RETENTION)
+        })
 
-    stops_count = [{"id": k, "value": v} for k, v in routes.items()]
-    return stops_count
+    return traffic_congestions
 
 
 def get_transport_counts():
@@ -155,28 +110,165 @@ def get_transport_counts():
     }
 
 
-def get_stops_data():
-    """Return full stop times information."""
-    stops = get_stops()
+def get_codes(values):
+    """Return unique values in order of appearance and code of every value."""
+    values = list(dict.fromkeys(values))
+    return values, {value: code for code, value in enumerate(values)}
+
+
+def get_trips_codes():
+    """
+    Return route names, service ids, trip ids and codes of every trip: route
+    id, route name code, service id code and trip id code.
+    """
     trips = get_trips()
+    trips_services = get_trips_services()
     routes_names = get_routes_names()
+    route_names, routes_codes = get_codes(routes_names.values())
+    service_ids, services_codes = get_codes(trips_services.values())
+    trips_codes = {
+        trip_id: TripCodes(
+            route_id,
+            routes_codes[routes_names[route_id]],
+            services_codes[trips_services[trip_id]],
+            trip_code
+        )
+        for trip_code, (trip_id, route_id) in enumerate(trips.items())
+    }
+    return route_names, service_ids, list(trips), trips_codes
+
+
+def scan_stop_times():
+    """
+    Stream stop_times.txt from static archive in a single pass. Return count
+    of stops per routes, compact arrivals (arrival time integers, route name
+    codes, service id codes and trip id codes) for each stop, route ids for
+    each segment between two consecutive stops of a trip and compact stops
+    sequence (stop sequences, stop id codes and arrival time integers) of
+    every trip. Stop times are expected to be grouped by trip.
+    """
+    route_names, service_ids, trip_ids, trips_codes = get_trips_codes()
+    stops_codes = {}
+
+    routes_stops = set()
+    stops_arrivals = {}
+    segments_routes = collections.defaultdict(set)
+    trips_stops = {}
+    prev_trip_id = prev_stop_id = None
+    for stop_time in iter_zip_csv(STATIC_ZIP_FILE, STATIC_STOP_TIMES_NAME):
+        trip_id = stop_time["trip_id"]
+        trip_codes = trips_codes.get(trip_id)
+        if trip_codes is None:
+            continue
 
-    stops_times_csv = load_csv(STATIC_STOP_TIMES_FILE)
-    for stop_time in stops_times_csv:
         stop_id = stop_time["stop_id"]
-        stop = stops[stop_id]
-        if "arrivals" not in stop:
-            stop["arrivals"] = []
+        routes_stops.add((trip_codes.route_code, stop_id))
+
+        if trip_id == prev_trip_id and stop_id != prev_stop_id:
+            segments_routes[(prev_stop_id, stop_id)].add(trip_codes.route_id)
+        prev_trip_id, prev_stop_id = trip_id, stop_id
+
+        arrivals = stops_arrivals.get(stop_id)
+        if arrivals is None:
+            arrivals = stops_arrivals[stop_id] = (
+                array.array("I"), array.array("H"), array.array("H"), array.array("I")
+            )
+
+        arrival_time = get_time_integer(stop_time["arrival_time"])
+        arrivals[0].append(arrival_time)
+        arrivals[1].append(trip_codes.route_code)
+        arrivals[2].append(trip_codes.service_code)
+        arrivals[3].append(trip_codes.trip_code)
+
+        trip_stops = trips_stops.get(trip_id)
+        if trip_stops is None:
+            trip_stops = trips_stops[trip_id] = (array.array("I"), array.array("I"), array.array("I"))
+
+        trip_stops[0].append(int(stop_time["stop_sequence"]))
+        trip_stops[1].append(stops_codes.setdefault(stop_id, len(stops_codes)))
+        trip_stops[2].append(arrival_time)
+
+    routes_counter = collections.Counter(route_code for route_code, _ in routes_stops)
+    stops_per_routes = [
+        {"id": route_name, "value": routes_counter[code]}
+        for code, route_name in enumerate(route_names)
+    ]
+
+    stops_arrivals = StopsArrivals(route_names, service_ids, trip_ids, stops_arrivals)
+    trips_stops = TripsStops(list(stops_codes), trips_stops)
+    return stops_per_routes, stops_arrivals, segments_routes, trips_stops
+
+
+def iter_stops_documents(stops_arrivals):
+    """
+    Yield stop documents with arrivals packed separately for every service,
+    releasing compact arrivals on the fly.
+    """
+    for stop_id, stop in get_snapshot().stops.items():
+        stop_arrivals = stops_arrivals.arrivals.pop(stop_id, ((), (), (), ()))
+        arrival_times, route_codes, service_codes, trip_codes = stop_arrivals
+        arrival_times = np.array(arrival_times, dtype=np.int64)
+        route_codes = np.array(route_codes, dtype=np.int64)
+        service_codes = np.array(service_codes, dtype=np.int64)
+        # stop trips dictionary is shared by arrivals of every service
+        stop_trips, trips_indexes = np.unique(np.array(trip_codes, dtype=np.int64), return_inverse=True)
+
+        arrivals = []
+        for service_code in np.unique(service_codes).tolist():
+            indexes = np.flatnonzero(service_codes == service_code)
+            route_names = [stops_arrivals.route_names[x] for x in route_codes[indexes].tolist()]
+            arrivals.append({
+                "service_id": stops_arrivals.service_ids[service_code],
+                **pack_arrivals(arrival_times[indexes], route_names, trips_indexes[indexes])
+            })
+
+        arrivals_trips = [stops_arrivals.trip_ids[x] for x in stop_trips.tolist()]
+        yield {"_id": stop_id, **stop, "arrivals": arrivals, "arrivals_trips": arrivals_trips}
+
+
+def iter_segments_documents(segments_routes):
+    """Yield road segments between consecutive stops with routes serving them."""
+    snapshot = get_snapshot()
+    for (from_stop_id, to_stop_id), route_ids in segments_routes.items():
+        from_stop = snapshot.stops.get(from_stop_id)
+        to_stop = snapshot.stops.get(to_stop_id)
+        if not from_stop or not to_stop or from_stop["coordinates"] == to_stop["coordinates"]:
+            continue
+
+        route_ids = sorted(route_ids)
+        yield {
+            "_id": get_segment_id(from_stop_id, to_stop_id),
+            "from_stop_id": from_stop_id,
+            "to_stop_id": to_stop_id,
+            "route_ids": route_ids,
+            "route_names": sorted({snapshot.routes_names.get(x, "") for x in route_ids} - {""}),
+            "coordinates": [from_stop["coordinates"], to_stop["coordinates"]]
+        }
+
+
+def iter_trips_documents(trips_stops):
+    """Yield trip schedules ordered by stop sequence, releasing compact stops on the fly."""
+    snapshot = get_snapshot()
+    trips = snapshot.trips
+    while trips_stops.trips:
+        trip_id, (stop_sequences, stop_codes, arrival_times) = trips_stops.trips.popitem()
+        stop_ids = [trips_stops.stop_ids[x] for x in stop_codes]
+        order = sorted(range(len(stop_ids)), key=stop_sequences.__getitem__)
+        order = [x for x in order if stop_ids[x] in snapshot.stops]
+        if len(order) < 2:
+            continue
+
+        yield {
+            "_id": trip_id,
+            "route_id": trips[trip_id],
+            "service_id": snapshot.trips_services.get(trip_id, ""),
+            "stop_ids": [stop_ids[x] for x in order],
+            "arrival_times": [arrival_times[x] for x in order],
+            "coordinates": [snapshot.stops[stop_ids[x]]["coordinates"] for x in order]
+        }
 
-        trip_id = stop_time["trip_id"]
-        route_id = trips[trip_id]
-        route_name = routes_names[route_id]
-        arrival_time = stop_time["arrival_time"]
-
-        stop["arrivals"].append({
-            "route_name": route_name,
-            "arrival_time": arrival_time,
-            "arrival_time_integer": get_time_integer(arrival_time)
-        })
 
-    return stops
+def iter_services_dates_documents():
+    """Yield ids of active services for each date of the services calendar."""
+    for date, service_ids in get_services_dates().items():
+        yield {"_id": date, "services": service_ids}
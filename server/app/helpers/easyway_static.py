@@ -1,37 +1,233 @@
 """This module provides helper functionality to work with easyway data."""
 
 import re
+import logging
+import threading
 import collections
+from datetime import datetime, timedelta
 
+from redis.exceptions import RedisError
 from shapely.geometry import Polygon
 
-from app import APP_CONFIG
-from app.utils.misc import load_csv, load_json
+from app import APP_CONFIG, REDIS
+from app.constants import REDIS_STATIC_VERSION_KEY
+from app.utils.misc import load_csv, load_json, get_file_hash
+from app.utils.time import DATE_FORMAT
+from app.helpers.regions import RegionClassifier
 
 
+LOGGER = logging.getLogger(__name__)
+
 ROUTE_TYPE_MAP = {
     "А": "Автобус",
     "Н-А": "Нічний Автобус",
     "Т": "Трамвай",
     "Тр": "Тролейбус"
 }
+ROUTE_TYPE_RE = re.compile(r"\d+")
+
+CALENDAR_DATE_FORMAT = "%Y%m%d"
+CALENDAR_WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+CALENDAR_SERVICE_ADDED = "1"
+CALENDAR_SERVICE_REMOVED = "2"
 
+STATIC_ZIP_FILE = f"{APP_CONFIG.STATIC_DIR}/static.zip"
 STATIC_ROUTES_FILE = f"{APP_CONFIG.STATIC_DIR}/routes.txt"
 STATIC_AGENCY_FILE = f"{APP_CONFIG.STATIC_DIR}/agency.txt"
 STATIC_TRIPS_FILE = f"{APP_CONFIG.STATIC_DIR}/trips.txt"
 STATIC_REGIONS_FILE = f"{APP_CONFIG.STATIC_DIR}/regions.json"
 STATIC_STOP_TIMES_FILE = f"{APP_CONFIG.STATIC_DIR}/stop_times.txt"
 STATIC_STOPS_FILE = f"{APP_CONFIG.STATIC_DIR}/stops.txt"
+STATIC_CALENDAR_FILE = f"{APP_CONFIG.STATIC_DIR}/calendar.txt"
+STATIC_CALENDAR_DATES_FILE = f"{APP_CONFIG.STATIC_DIR}/calendar_dates.txt"
+STATIC_STOP_TIMES_NAME = "stop_times.txt"
+# bump when layout of documents built from static data changes, so the next
+# static task rebuilds them even if static archive itself is the same
+STATIC_LAYOUT_VERSION = 1
+
+
+class StaticSnapshot:
+    """
+    Process-wide snapshot of parsed easyway static data. The snapshot
+    is keyed by static.zip content hash and is reloaded in place only
+    when the published static version changes.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.routes_names = {}
+        self.routes_types = {}
+        self.routes = []
+        self.routes_trips = {}
+        self.trips = {}
+        self.trips_services = {}
+        self.services_dates = {}
+        self.stops = {}
+        self.regions_polygons = {}
+        self.regions_classifier = RegionClassifier({})
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        """Return True if snapshot contains parsed static data."""
+        return self.version is not None
+
+    def load(self, version):
+        """Parse static files and swap snapshot data if version has changed."""
+        with self._lock:
+            if version == self.version:
+                return False
+
+            try:
+                routes_names = _parse_routes_names()
+                routes_types = {k: get_route_type(v) for k, v in routes_names.items()}
+                routes = _parse_routes()
+                routes_trips = _parse_routes_trips()
+                trips = _parse_trips()
+                trips_services = _parse_trips_services()
+                services_dates = _parse_services_dates()
+                stops = _parse_stops()
+                regions_polygons = _parse_regions_bounds()
+            except (OSError, KeyError, TypeError, AttributeError, ValueError) as err:
+                LOGGER.error("Failed to load easyway static snapshot (%s): %s", version, err)
+                return False
+
+            self.routes_names = routes_names
+            self.routes_types = routes_types
+            self.routes = routes
+            self.routes_trips = routes_trips
+            self.trips = trips
+            self.trips_services = trips_services
+            self.services_dates = services_dates
+            self.stops = stops
+            self.regions_polygons = regions_polygons
+            self.regions_classifier = RegionClassifier(regions_polygons)
+            self.version = version
+
+        LOGGER.info("Loaded easyway static snapshot: %s", version)
+        return True
+
+    def refresh(self):
+        """Reload snapshot if the published static version differs from the loaded one."""
+        version = get_static_version()
+        if version is None:
+            LOGGER.error("Couldn't find easyway static version.")
+            return False
+
+        if version == self.version:
+            return False
+
+        return self.load(version)
+
+
+STATIC_SNAPSHOT = StaticSnapshot()
+
+
+def get_static_version():
+    """Return published static version or hash of the local static archive."""
+    try:
+        version = REDIS.get(REDIS_STATIC_VERSION_KEY)
+    except RedisError as err:
+        LOGGER.error("Couldn't retrieve easyway static version: %s", err)
+        version = None
+
+    if version:
+        return version.decode("utf-8")
+
+    try:
+        return get_archive_version()
+    except OSError:
+        return None
+
+
+def get_archive_version():
+    """Return static version of the local static archive and documents layout."""
+    return f"{get_file_hash(STATIC_ZIP_FILE)}.{STATIC_LAYOUT_VERSION}"
+
+
+def get_snapshot():
+    """Return static snapshot, loading it on first access."""
+    if not STATIC_SNAPSHOT.loaded:
+        STATIC_SNAPSHOT.refresh()
+
+    return STATIC_SNAPSHOT
 
 
 def get_routes_names():
+    """Return short name for each route id."""
+    return get_snapshot().routes_names
+
+
+def get_routes_types():
+    """Return transport type for each route id."""
+    return get_snapshot().routes_types
+
+
+def get_routes():
+    """Return static data for routes in Lviv."""
+    return get_snapshot().routes
+
+
+def get_routes_trips():
+    """Return list of trips for each route in Lviv."""
+    return get_snapshot().routes_trips
+
+
+def get_trips():
+    """Return trip_id and route_id mapping"""
+    return get_snapshot().trips
+
+
+def get_trips_services():
+    """Return trip_id and service_id mapping"""
+    return get_snapshot().trips_services
+
+
+def get_services_dates():
+    """Return ids of active services for each date of the services calendar."""
+    return get_snapshot().services_dates
+
+
+def get_active_services(services_dates, date):
+    """
+    Return ids of services active at date or None when feed has no services
+    calendar, so every service is considered active.
+    """
+    if not services_dates:
+        return None
+
+    return services_dates.get(date.strftime(DATE_FORMAT), [])
+
+
+def get_stops():
+    """Return copy of stops information from static stops file."""
+    return {k: dict(v) for k, v in get_snapshot().stops.items()}
+
+
+def get_regions_bounds():
+    """Return polygon for each region by its bounds."""
+    return get_snapshot().regions_polygons
+
+
+def get_regions_classifier():
+    """Return batch classifier built from regions polygons."""
+    return get_snapshot().regions_classifier
+
+
+def get_route_type(route_short_name):
+    """Return transport type by route short name."""
+    route_type_short = ROUTE_TYPE_RE.sub("", route_short_name)
+    return ROUTE_TYPE_MAP.get(route_type_short, "Інші")
+
+
+def _parse_routes_names():
     """Return short name for each route id."""
     routes_csv = load_csv(STATIC_ROUTES_FILE)
 
     return {route["route_id"]: route["route_short_name"] for route in routes_csv}
 
 
-def get_routes():
+def _parse_routes():
     """Load csv file with static data for routes in Lviv."""
     agency_csv = load_csv(STATIC_AGENCY_FILE)
     routes_csv = load_csv(STATIC_ROUTES_FILE)
@@ -40,12 +236,9 @@ def get_routes():
     routes = []
     for route in routes_csv:
         route_short_name = route["route_short_name"]
-        route_type_short = re.sub(r"\d+", "", route_short_name)
-        route_type = ROUTE_TYPE_MAP.get(route_type_short, "Інші")
-
         routes.append({
             "id": route["route_id"],
-            "route_type": route_type,
+            "route_type": get_route_type(route_short_name),
             "short_name": route_short_name,
             "long_name": route["route_long_name"],
             "agency_id": route["agency_id"],
@@ -56,7 +249,7 @@ def get_routes():
     return routes
 
 
-def get_routes_trips():
+def _parse_routes_trips():
     """Return list of trips for each route in Lviv."""
     trips_csv = load_csv(STATIC_TRIPS_FILE)
 
@@ -69,7 +262,7 @@ def get_routes_trips():
     return routes_trips
 
 
-def get_trips():
+def _parse_trips():
     """Return trip_id and route_id mapping"""
     trips_csv = load_csv(STATIC_TRIPS_FILE)
 
@@ -83,7 +276,47 @@ def get_trips():
     return trips
 
 
-def get_stops():
+def _parse_trips_services():
+    """Return trip_id and service_id mapping"""
+    trips_csv = load_csv(STATIC_TRIPS_FILE)
+
+    return {trip["trip_id"]: trip.get("service_id", "") for trip in trips_csv}
+
+
+def _load_optional_csv(filepath):
+    """Return parsed csv file or empty list if feed doesn't contain it."""
+    try:
+        return load_csv(filepath) or []
+    except FileNotFoundError:
+        return []
+
+
+def _parse_services_dates():
+    """
+    Return sorted ids of active services for each date: weekly services
+    from calendar file with exceptions from calendar dates file applied.
+    """
+    services_dates = collections.defaultdict(set)
+    for calendar in _load_optional_csv(STATIC_CALENDAR_FILE):
+        date = datetime.strptime(calendar["start_date"], CALENDAR_DATE_FORMAT)
+        end_date = datetime.strptime(calendar["end_date"], CALENDAR_DATE_FORMAT)
+        weekdays = [calendar[weekday] == "1" for weekday in CALENDAR_WEEKDAYS]
+        while date <= end_date:
+            if weekdays[date.weekday()]:
+                services_dates[date.strftime(DATE_FORMAT)].add(calendar["service_id"])
+            date += timedelta(days=1)
+
+    for calendar_date in _load_optional_csv(STATIC_CALENDAR_DATES_FILE):
+        date = datetime.strptime(calendar_date["date"], CALENDAR_DATE_FORMAT).strftime(DATE_FORMAT)
+        if calendar_date["exception_type"] == CALENDAR_SERVICE_ADDED:
+            services_dates[date].add(calendar_date["service_id"])
+        elif calendar_date["exception_type"] == CALENDAR_SERVICE_REMOVED:
+            services_dates[date].discard(calendar_date["service_id"])
+
+    return {date: sorted(services) for date, services in sorted(services_dates.items())}
+
+
+def _parse_stops():
     """Return stops information from static stops file."""
     stops_csv = load_csv(STATIC_STOPS_FILE)
 
@@ -104,7 +337,7 @@ def get_stops():
     return stops
 
 
-def get_regions_bounds():
+def _parse_regions_bounds():
     """Return polygon for each region by its bounds."""
     regions_bounds = load_json(STATIC_REGIONS_FILE)
     regions_polygons = {k: Polygon(v) for k, v in regions_bounds.items()}
@@ -0,0 +1,104 @@
+"""This module provides conditional fetching of GTFS realtime feed."""
+
+import hashlib
+import logging
+import collections
+from http import HTTPStatus
+
+import requests
+from requests.adapters import HTTPAdapter
+from redis.exceptions import RedisError
+
+from app import REDIS
+
+
+LOGGER = logging.getLogger(__name__)
+
+FEED_TIMEOUT = 10  # 10 seconds
+FEED_POOL_SIZE = 4
+
+FeedResult = collections.namedtuple("FeedResult", ["content", "modified", "state"])
+
+
+def create_session():
+    """Return requests session with pooled and reused connections."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=FEED_POOL_SIZE, max_retries=1)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class FeedFetcher:
+    """
+    Class that provides conditional fetching of realtime feed. It reuses one
+    pooled session per process, sends If-None-Match/If-Modified-Since headers
+    and detects unchanged payloads by their hash. Feed state is kept in redis,
+    so it is shared by all worker processes.
+    """
+
+    def __init__(self, url, state_key):
+        self.url = url
+        self.state_key = state_key
+        self.session = create_session()
+
+    def get_state(self):
+        """Return saved state of the last processed feed."""
+        try:
+            state = REDIS.hgetall(self.state_key)
+        except RedisError as err:
+            LOGGER.error("Couldn't retrieve feed state (%s): %s", self.url, err)
+            return {}
+
+        return {k.decode("utf-8"): v.decode("utf-8") for k, v in state.items()}
+
+    def fetch(self):
+        """Return fetched feed content and whether it has changed since last commit."""
+        state = self.get_state()
+        headers = {}
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+
+        try:
+            response = self.session.get(self.url, headers=headers, timeout=FEED_TIMEOUT)
+        except requests.exceptions.RequestException as err:
+            LOGGER.error("Failed to fetch feed (%s): %s", self.url, err)
+            return None
+
+        if response.status_code == HTTPStatus.NOT_MODIFIED:
+            return FeedResult(None, False, state)
+
+        if response.status_code != HTTPStatus.OK:
+            LOGGER.error("Failed to fetch feed (%s): %s", self.url, response.status_code)
+            return None
+
+        content_hash = hashlib.sha1(response.content).hexdigest()
+        new_state = {
+            "etag": response.headers.get("ETag", ""),
+            "last_modified": response.headers.get("Last-Modified", ""),
+            "content_hash": content_hash,
+            "header_timestamp": state.get("header_timestamp", ""),
+        }
+        modified = content_hash != state.get("content_hash")
+        return FeedResult(response.content, modified, new_state)
+
+    @staticmethod
+    def is_new_header(result, header_timestamp):
+        """Return True if feed header timestamp differs from the last processed one."""
+        if not header_timestamp:
+            return True
+
+        return str(header_timestamp) != result.state.get("header_timestamp")
+
+    def commit(self, result, header_timestamp=None):
+        """Save state of successfully processed feed."""
+        state = dict(result.state)
+        if header_timestamp:
+            state["header_timestamp"] = str(header_timestamp)
+
+        try:
+            REDIS.hset(self.state_key, mapping=state)
+        except RedisError as err:
+            LOGGER.error("Couldn't save feed state (%s): %s", self.url, err)
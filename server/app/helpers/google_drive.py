@@ -10,6 +10,8 @@ from app import APP_CONFIG
 
 LOGGER = logging.getLogger(__name__)
 
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # 8 MB, must be a multiple of 256 KB
+
 
 class GoogleDrive:
     """Class that provides functionality to work with google drive"""
@@ -27,8 +29,8 @@ class GoogleDrive:
         )
 
     @classmethod
-    def upload_file(cls, name, directory_id, data, mimetype):
-        """Upload file data to provided google drive directory."""
+    def upload_file(cls, name, directory_id, data, mimetype, chunksize=UPLOAD_CHUNK_SIZE):
+        """Upload file data to provided google drive directory by resumable chunks."""
         file_metadata = {
             "name": name,
             "parents": [directory_id],
@@ -47,7 +49,7 @@ class GoogleDrive:
                 cls.GOOGLE_DRIVE_SERVICE_VERSION,
                 credentials=credentials
             )
-            file_media = http.MediaIoBaseUpload(data, mimetype=mimetype, resumable=True)
+            file_media = http.MediaIoBaseUpload(data, mimetype=mimetype, chunksize=chunksize, resumable=True)
             file_id = google_drive.files().create(body=file_metadata, media_body=file_media, fields="id").execute()
         except errors.Error as err:
             LOGGER.error("Failed to upload file into google drive: %s", err)
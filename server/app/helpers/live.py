@@ -0,0 +1,156 @@
+"""This module provides live stream of vehicle positions changes."""
+
+import json
+import time
+import queue
+import logging
+import threading
+
+from redis.exceptions import RedisError
+
+from app import REDIS
+from app.constants import REDIS_TRAFFIC_STREAM_KEY
+
+
+LOGGER = logging.getLogger(__name__)
+
+STREAM_MAX_LENGTH = 1000
+STREAM_BLOCK_TIMEOUT = 15000  # 15 seconds in ms
+STREAM_RETRY_DELAY = 1  # 1 second
+STREAM_MAX_SUBSCRIBERS = 16  # per web worker, half of its threads
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class LiveTraffic:
+    """
+    Class that provides methods to publish and read vehicle positions changes
+    through redis stream. Every stream entry is one collected tick with
+    compact encoded vehicles whose position has changed.
+    """
+
+    @staticmethod
+    def publish(traffic, mask):
+        """Append changed vehicles of collected traffic batch to the stream."""
+        vehicles = traffic.to_compact(mask)
+        if not vehicles:
+            return None
+
+        return REDIS.xadd(
+            REDIS_TRAFFIC_STREAM_KEY,
+            {"timestamp": traffic.timestamp, "vehicles": json.dumps(vehicles, ensure_ascii=False)},
+            maxlen=STREAM_MAX_LENGTH,
+            approximate=True
+        )
+
+    @staticmethod
+    def read(last_id, block=STREAM_BLOCK_TIMEOUT):
+        """
+        Return stream entries (id, timestamp, vehicles) after provided entry id,
+        without waiting for new entries if block is None.
+        """
+        try:
+            response = REDIS.xread({REDIS_TRAFFIC_STREAM_KEY: last_id}, block=block)
+        except RedisError as err:
+            LOGGER.error("Couldn't read live traffic stream: %s", err)
+            return None
+
+        entries = []
+        for _, stream_entries in response:
+            for entry_id, fields in stream_entries:
+                entries.append((
+                    entry_id.decode("utf-8"),
+                    int(fields[b"timestamp"]),
+                    json.loads(fields[b"vehicles"])
+                ))
+
+        return entries
+
+    @staticmethod
+    def filter_vehicles(vehicles, route=None, bbox=None):
+        """Return compact vehicles filtered by route short name and bounding box."""
+        if route:
+            vehicles = [x for x in vehicles if x[1] == route]
+
+        if bbox:
+            min_latitude, min_longitude, max_latitude, max_longitude = bbox
+            vehicles = [
+                x for x in vehicles
+                if min_latitude <= x[2] <= max_latitude and min_longitude <= x[3] <= max_longitude
+            ]
+
+        return vehicles
+
+
+def get_entry_key(entry_id):
+    """Return comparable (milliseconds, sequence) key of stream entry id."""
+    milliseconds, _, sequence = entry_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+class LiveTrafficReader:
+    """
+    Process-wide single reader of live traffic stream that fans entries out
+    to queues of subscribed clients, so streaming clients neither block on
+    own redis reads nor hold own redis connections. The reader thread is
+    started by the first subscriber and stops when the last one leaves.
+    """
+
+    def __init__(self, max_subscribers=STREAM_MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self.subscribers = set()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, subscriber):
+        with self._lock:
+            return subscriber in self.subscribers
+
+    def subscribe(self):
+        """Return queue of new stream entries lists or None if subscribers limit is reached."""
+        with self._lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+
+            subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+            self.subscribers.add(subscriber)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="live-traffic-reader", daemon=True)
+                self._thread.start()
+
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """Remove subscriber queue, the reader stops after the last one."""
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def _run(self):
+        """Read new stream entries and put them to every subscriber queue."""
+        last_id = "$"
+        while True:
+            with self._lock:
+                if not self.subscribers:
+                    self._thread = None
+                    return
+
+            entries = LiveTraffic.read(last_id)
+            if entries is None:
+                time.sleep(STREAM_RETRY_DELAY)
+                continue
+
+            if not entries:
+                continue
+
+            last_id = entries[-1][0]
+            with self._lock:
+                subscribers = list(self.subscribers)
+
+            for subscriber in subscribers:
+                try:
+                    subscriber.put_nowait(entries)
+                except queue.Full:
+                    LOGGER.warning("Dropped live traffic subscriber that doesn't keep up with the stream.")
+                    self.unsubscribe(subscriber)
+
+
+LIVE_TRAFFIC_READER = LiveTrafficReader()
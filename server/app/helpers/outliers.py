@@ -1,11 +1,76 @@
-"""This module provides functionality to work with outliers."""
+"""This module provides vectorized statistics to work with outliers."""
 
 import numpy as np
 
 
-def iqr(iterable, q1_bound=0.25, q2_bound=0.75):
-    """Filter out outliers using iqr method based on quantiles."""
-    q1_value = np.quantile(iterable, q1_bound)
-    q2_value = np.quantile(iterable, q2_bound)
+MAD_SCALE = 0.6745  # makes MAD consistent with standard deviation for normal distribution
 
-    return list(filter(lambda x: q1_value <= x <= q2_value, iterable))
+
+def quantiles(values, bounds):
+    """Return quantiles of values for every bound computed in a single pass."""
+    return np.quantile(np.asarray(values, dtype=np.float64), bounds)
+
+
+def weighted_quantiles(values, weights, bounds):
+    """
+    Return weighted quantiles of values: the smallest value whose cumulative
+    weight reaches the bound share of total weight, so histogram bins with
+    counts as weights give the same result as the raw values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(values, kind="stable")
+    cumulative = np.cumsum(np.asarray(weights, dtype=np.float64)[order])
+    indexes = np.searchsorted(cumulative, np.asarray(bounds) * cumulative[-1])
+    return values[order][np.minimum(indexes, len(values) - 1)]
+
+
+def grouped_quantiles(values, groups, bounds, minlength=0):
+    """
+    Return quantiles of values within every group, groups are non negative
+    integer codes. Values are sorted once for all bounds, quantiles are
+    linearly interpolated like np.quantile and are nan for empty groups.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    groups = np.asarray(groups, dtype=np.int64)
+    order = np.argsort(values)
+    order = order[np.argsort(groups[order], kind="stable")]
+    sorted_values = values[order]
+
+    counts = np.bincount(groups, minlength=minlength)
+    starts = np.cumsum(counts) - counts
+    lasts = starts + np.maximum(counts - 1, 0)
+    present = counts > 0
+
+    bounds = np.asarray(bounds, dtype=np.float64)
+    positions = starts + np.multiply.outer(bounds, lasts - starts)
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.minimum(lower + 1, lasts)
+    fraction = positions - lower
+
+    result = np.full(positions.shape, np.nan)
+    result[..., present] = (
+        sorted_values[lower[..., present]] * (1 - fraction[..., present]) +
+        sorted_values[upper[..., present]] * fraction[..., present]
+    )
+    return result
+
+
+def mad_mask(values, threshold=3.5, groups=None):
+    """Return mask of values whose modified z-score based on median absolute deviation is within threshold."""
+    values = np.asarray(values, dtype=np.float64)
+    if not values.size:
+        return np.zeros(0, dtype=bool)
+
+    if groups is None:
+        median = np.median(values)
+        deviations = np.abs(values - median)
+        mad = np.median(deviations)
+    else:
+        median = grouped_quantiles(values, groups, 0.5)[groups]
+        deviations = np.abs(values - median)
+        mad = grouped_quantiles(deviations, groups, 0.5)[groups]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = MAD_SCALE * deviations / mad
+
+    return (scores <= threshold) | (deviations == 0)
@@ -0,0 +1,357 @@
+"""This module provides realtime arrivals predictions from live vehicles positions."""
+
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pymongo
+from redis.exceptions import RedisError
+
+from app import MONGO_DATABASE, REDIS
+from app.constants import REDIS_STOPS_PREDICTIONS_KEY
+from app.utils.time import DAY, TIME_FORMAT, get_time_integer, get_time_string
+from app.helpers.segments import project
+from app.helpers.easyway_static import get_static_version, get_services_dates, get_active_services
+
+
+LOGGER = logging.getLogger(__name__)
+
+MATCH_DISTANCE = 100  # meters from vehicle to the trip path
+MAX_BEARING_DIFFERENCE = 90  # degrees between vehicle bearing and trip path direction
+MAX_DELAY = 1800  # 30 min, vehicles further from schedule are not matched
+PREDICTIONS_HORIZON = 3600  # 1 hour ahead of vehicle position
+PREDICTIONS_TIMEOUT = 900  # 15 min, stale predictions disappear when collection stops
+
+
+class TripIndex:
+    """
+    Flat arrays of trips stops sequences: stops of every trip are stored
+    consecutively with projected coordinates and scheduled arrival times,
+    so vehicles are matched to paths of their trips in vectorized passes.
+    """
+
+    def __init__(self, trips):
+        self.ids = [trip["_id"] for trip in trips]
+        self.positions = {trip_id: index for index, trip_id in enumerate(self.ids)}
+
+        self.counts = np.array([len(x["stop_ids"]) for x in trips], dtype=np.int64)
+        self.starts = np.cumsum(self.counts) - self.counts
+        self.stop_ids = [stop_id for x in trips for stop_id in x["stop_ids"]]
+        self.times = np.array([time for x in trips for time in x["arrival_times"]], dtype=np.int64)
+
+        coordinates = np.array([c for x in trips for c in x["coordinates"]], dtype=np.float64).reshape(-1, 2)
+        self.origin = coordinates[:, 0].mean() if len(coordinates) else 0
+        self.x, self.y = project(coordinates[:, 0], coordinates[:, 1], self.origin)
+
+        route_ids = sorted({x["route_id"] for x in trips})
+        self.routes_codes = {route_id: code for code, route_id in enumerate(route_ids)}
+        self.trips_routes = np.array([self.routes_codes[x["route_id"]] for x in trips], dtype=np.int64)
+        service_ids = sorted({x.get("service_id", "") for x in trips})
+        self.services_codes = {service_id: code for code, service_id in enumerate(service_ids)}
+        self.trips_services = np.array(
+            [self.services_codes[x.get("service_id", "")] for x in trips],
+            dtype=np.int64
+        )
+        self.first_times = self.times[self.starts] if len(trips) else np.zeros(0, dtype=np.int64)
+        self.last_times = self.times[self.starts + self.counts - 1] if len(trips) else np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _get_active_trips(self, seconds, service_days):
+        """
+        Return trips indexes sorted by route of services active at service
+        days whose schedule with max delay covers time of day.
+        """
+        active = np.zeros(len(self), dtype=bool)
+        for services, offset in service_days:
+            day_seconds = seconds + offset
+            running = (self.first_times - MAX_DELAY <= day_seconds) & (day_seconds <= self.last_times + MAX_DELAY)
+            if services is not None:
+                services_codes = [self.services_codes[x] for x in services if x in self.services_codes]
+                running &= np.isin(self.trips_services, services_codes)
+            active |= running
+
+        trips = np.flatnonzero(active)
+        return trips[np.argsort(self.trips_routes[trips], kind="stable")]
+
+    def _get_candidates(self, route_ids, trip_ids, seconds, service_days):
+        """
+        Return (vehicle, trip) candidate pairs: vehicle reported trip when it
+        is known, otherwise every active trip of the vehicle route.
+        """
+        known_trips = np.fromiter(
+            (self.positions.get(trip_id, -1) for trip_id in trip_ids),
+            dtype=np.int64,
+            count=len(trip_ids)
+        )
+        routes_codes = np.fromiter(
+            (self.routes_codes.get(route_id, -1) for route_id in route_ids),
+            dtype=np.int64,
+            count=len(route_ids)
+        )
+
+        active_trips = self._get_active_trips(seconds, service_days)
+        active_routes = self.trips_routes[active_trips]
+        route_starts = np.searchsorted(active_routes, routes_codes, side="left")
+        route_ends = np.searchsorted(active_routes, routes_codes, side="right")
+
+        known = known_trips >= 0
+        counts = np.where(known, 1, np.where(routes_codes >= 0, route_ends - route_starts, 0))
+        vehicles = np.repeat(np.arange(len(route_ids)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        trips = known_trips[vehicles]
+        unknown = ~known[vehicles]
+        trips[unknown] = active_trips[route_starts[vehicles[unknown]] + offsets[unknown]]
+        return vehicles, trips
+
+    def match(self, route_ids, trip_ids, latitudes, longitudes, bearings, speeds, seconds, service_days=None):
+        """
+        Match vehicles to the path between two consecutive stops of their
+        trips within match distance and heading along the path when moving.
+        Among candidates the position closest to schedule wins, so loops and
+        several trips of the same route are told apart, every trip keeps one
+        vehicle. Return matched vehicles, trips, flat indexes of the last
+        passed stops, scheduled times at vehicles positions and delays.
+        Service days are (active services, offset) pairs, by default every
+        service is active today and the previous day.
+        """
+        empty = np.zeros(0, dtype=np.int64)
+        if not len(self) or not len(route_ids):
+            return empty, empty, empty, np.zeros(0, dtype=np.float64), empty
+
+        service_days = service_days or [(None, 0), (None, DAY)]
+        vehicles, trips = self._get_candidates(route_ids, trip_ids, seconds, service_days)
+        vehicles, trips, stops = self._get_paths(vehicles, trips)
+        fractions, distances, heading = self._project(vehicles, stops, latitudes, longitudes, bearings, speeds)
+
+        scheduled = self.times[stops] + fractions * (self.times[stops + 1] - self.times[stops])
+        delays = (seconds - scheduled + DAY / 2) % DAY - DAY / 2
+        near = (distances <= MATCH_DISTANCE) & heading & (np.abs(delays) <= MAX_DELAY)
+        return self._choose_nearest(
+            vehicles[near], trips[near], stops[near], scheduled[near], delays[near], distances[near]
+        )
+
+    def _get_paths(self, vehicles, trips):
+        """Expand (vehicle, trip) candidates into (vehicle, trip, path between stops) candidates."""
+        counts = self.counts[trips] - 1
+        vehicles, trips = np.repeat(vehicles, counts), np.repeat(trips, counts)
+        stops = self.starts[trips] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return vehicles, trips, stops
+
+    def _project(self, vehicles, stops, latitudes, longitudes, bearings, speeds):
+        """
+        Project vehicles onto paths from stops to the next ones. Return passed
+        fractions of paths, distances to paths and mask of vehicles heading
+        along paths or standing still.
+        """
+        vehicles_x, vehicles_y = project(np.asarray(latitudes)[vehicles], np.asarray(longitudes)[vehicles], self.origin)
+        start_x, start_y = self.x[stops], self.y[stops]
+        delta_x, delta_y = self.x[stops + 1] - start_x, self.y[stops + 1] - start_y
+        length = delta_x ** 2 + delta_y ** 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fractions = ((vehicles_x - start_x) * delta_x + (vehicles_y - start_y) * delta_y) / length
+
+        fractions = np.clip(np.nan_to_num(fractions), 0, 1)
+        distances = np.hypot(vehicles_x - start_x - fractions * delta_x, vehicles_y - start_y - fractions * delta_y)
+
+        directions = np.degrees(np.arctan2(delta_x, delta_y))
+        bearing_differences = np.abs((np.asarray(bearings)[vehicles] - directions + 180) % 360 - 180)
+        moving = (np.asarray(speeds)[vehicles] > 0) & (length > 0)
+        return fractions, distances, (bearing_differences <= MAX_BEARING_DIFFERENCE) | ~moving
+
+    @staticmethod
+    def _choose_nearest(vehicles, trips, stops, scheduled, delays, distances):
+        """
+        Return one candidate per vehicle and per trip: the position closest to
+        schedule and then to the path wins.
+        """
+        order = np.lexsort((distances, np.abs(delays), vehicles))
+        _, nearest = np.unique(vehicles[order], return_index=True)
+        chosen = order[nearest]
+
+        order = chosen[np.lexsort((np.abs(delays[chosen]), trips[chosen]))]
+        _, nearest = np.unique(trips[order], return_index=True)
+        chosen = order[nearest]
+
+        delays = np.rint(delays[chosen]).astype(np.int64)
+        return vehicles[chosen], trips[chosen], stops[chosen], scheduled[chosen], delays
+
+    def predict(self, trips, stops, scheduled, delays):
+        """
+        Return flat indexes of upcoming stops of matched trips within horizon
+        with their scheduled and predicted arrival times and matched positions.
+        """
+        counts = self.starts[trips] + self.counts[trips] - 1 - stops
+        matched = np.repeat(np.arange(len(trips)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        upcoming = np.repeat(stops + 1, counts) + offsets
+
+        within = self.times[upcoming] - scheduled[matched] <= PREDICTIONS_HORIZON
+        matched, upcoming = matched[within], upcoming[within]
+        predicted = np.maximum(self.times[upcoming] + delays[matched], 0)
+        return upcoming, self.times[upcoming], predicted, matched
+
+
+class TripsSnapshot:
+    """
+    Process-wide trip index loaded from `trip_schedules` collection and
+    reloaded only when the published static version changes.
+    """
+
+    collection = MONGO_DATABASE.trip_schedules
+
+    def __init__(self):
+        self.version = None
+        self.index = TripIndex([])
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Reload trip index if the published static version has changed."""
+        version = get_static_version()
+        if version is None or version == self.version:
+            return False
+
+        with self._lock:
+            if version == self.version:
+                return False
+
+            try:
+                trips = list(self.collection.find(sort=[("_id", pymongo.ASCENDING)]))
+            except pymongo.errors.PyMongoError as err:
+                LOGGER.error("Couldn't retrieve trip schedules: %s", err)
+                return False
+
+            self.index = TripIndex(trips)
+            self.version = version
+
+        LOGGER.info("Loaded %s trip schedules: %s", len(trips), version)
+        return True
+
+
+TRIPS_SNAPSHOT = TripsSnapshot()
+
+
+def get_trip_index():
+    """Return trip index of the current static version."""
+    TRIPS_SNAPSHOT.refresh()
+    return TRIPS_SNAPSHOT.index
+
+
+def merge_predictions(arrivals, predictions, start, end, limit=None):
+    """
+    Return scheduled arrivals completed with realtime predictions, arrivals
+    are filtered and ordered by predicted time when it is known.
+    """
+    # predictions are published in trip time, after midnight it may exceed one day
+    predicted = {(x[0], x[1] % DAY, x[4]): x for x in predictions}
+
+    merged = []
+    for arrival in arrivals:
+        arrival_time = arrival["arrival_time_integer"]
+        prediction = predicted.get((arrival["route_name"], arrival_time % DAY, arrival["trip_id"]))
+        if prediction is None:
+            arrival.update(predicted_time=None, predicted_time_integer=None, delay=None, vehicle_id=None)
+        else:
+            delay = prediction[2] - prediction[1]
+            arrival_time += delay
+            arrival.update(
+                predicted_time=get_time_string(arrival_time),
+                predicted_time_integer=arrival_time,
+                delay=delay,
+                vehicle_id=prediction[3]
+            )
+
+        if start <= arrival_time <= end:
+            merged.append((arrival_time, arrival))
+
+    merged.sort(key=lambda x: x[0])
+    return [arrival for _, arrival in merged][:None if limit is None else max(limit, 0)]
+
+
+def match_traffic(traffic, index):
+    """Return vehicles of traffic batch matched to trips of services active at the batch time."""
+    now = datetime.fromtimestamp(traffic.timestamp)
+    services_dates = get_services_dates()
+    service_days = [
+        (get_active_services(services_dates, now.date()), 0),
+        (get_active_services(services_dates, now.date() - timedelta(days=1)), DAY)
+    ]
+    return index.match(
+        [traffic.routes[x][0] for x in traffic.route_codes.tolist()],
+        traffic.trip_ids,
+        traffic.latitudes,
+        traffic.longitudes,
+        traffic.bearings,
+        traffic.speeds,
+        get_time_integer(now.strftime(TIME_FORMAT)),
+        service_days
+    )
+
+
+def get_stops_predictions(traffic, index, matches):
+    """
+    Return predictions of upcoming stops of matched vehicles grouped by
+    stop id as [route name, scheduled time, predicted time, vehicle id, trip id].
+    """
+    vehicles, trips, stops, scheduled, delays = matches
+    upcoming, scheduled_times, predicted_times, matched = index.predict(trips, stops, scheduled, delays)
+
+    stops_predictions = {}
+    rows = zip(
+        upcoming.tolist(),
+        scheduled_times.tolist(),
+        predicted_times.tolist(),
+        vehicles[matched].tolist(),
+        trips[matched].tolist()
+    )
+    for stop, scheduled_time, predicted_time, vehicle, trip in rows:
+        route_short_name = traffic.routes[traffic.route_codes[vehicle]][1]
+        stops_predictions.setdefault(index.stop_ids[stop], []).append(
+            [route_short_name, scheduled_time, predicted_time, traffic.vehicle_ids[vehicle], index.ids[trip]]
+        )
+
+    return stops_predictions
+
+
+class StopsPredictions:
+    """
+    Class that provides methods to work with realtime arrivals predictions.
+    Every tick replaces redis hash of stop id mapped to compact json list of
+    [route name, scheduled time, predicted time, vehicle id, trip id] predictions.
+    """
+
+    @staticmethod
+    def update(traffic, index):
+        """Match vehicles of collected traffic batch to trips and store upcoming stops predictions."""
+        matches = match_traffic(traffic, index)
+        stops_predictions = get_stops_predictions(traffic, index, matches)
+
+        pipeline = REDIS.pipeline()
+        pipeline.delete(REDIS_STOPS_PREDICTIONS_KEY)
+        if stops_predictions:
+            pipeline.hset(REDIS_STOPS_PREDICTIONS_KEY, mapping={
+                stop_id: json.dumps(predictions, ensure_ascii=False)
+                for stop_id, predictions in stops_predictions.items()
+            })
+            pipeline.expire(REDIS_STOPS_PREDICTIONS_KEY, PREDICTIONS_TIMEOUT)
+        pipeline.execute()
+
+        LOGGER.info(
+            "Matched %s of %s vehicles to trips, predicted arrivals to %s stops.",
+            len(matches[0]), len(traffic), len(stops_predictions)
+        )
+        return len(stops_predictions)
+
+    @staticmethod
+    def get(stop_id):
+        """Return realtime predictions for stop or None."""
+        try:
+            predictions = REDIS.hget(REDIS_STOPS_PREDICTIONS_KEY, stop_id)
+        except RedisError as err:
+            LOGGER.error("Couldn't retrieve stop predictions (%s): %s", stop_id, err)
+            return None
+
+        return json.loads(predictions) if predictions else []
@@ -0,0 +1,48 @@
+"""This module provides functionality to classify coordinates by city regions."""
+
+import numpy as np
+from shapely import vectorized
+
+
+class RegionClassifier:
+    """
+    Batch classifier of coordinates into region polygons. Points are
+    checked against polygon bounds first and only candidates inside
+    bounds are passed to the vectorized shapely containment check.
+    """
+
+    def __init__(self, regions_polygons):
+        self.names = list(regions_polygons)
+        self.polygons = [regions_polygons[name] for name in self.names]
+        self.bounds = [polygon.bounds for polygon in self.polygons]
+
+    def __len__(self):
+        return len(self.names)
+
+    def classify(self, latitudes, longitudes):
+        """
+        Return (point, region) index pairs for every region that contains
+        the point. Region polygons may overlap along their borders, so a
+        point can belong to several regions or to none of them.
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+
+        points, regions = [], []
+        for index, polygon in enumerate(self.polygons):
+            min_lat, min_lon, max_lat, max_lon = self.bounds[index]
+            candidates = np.flatnonzero(
+                (latitudes >= min_lat) & (latitudes <= max_lat) &
+                (longitudes >= min_lon) & (longitudes <= max_lon)
+            )
+            if not candidates.size:
+                continue
+
+            inside = candidates[vectorized.contains(polygon, latitudes[candidates], longitudes[candidates])]
+            points.append(inside)
+            regions.append(np.full(inside.size, index, dtype=np.int64))
+
+        if not points:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        return np.concatenate(points), np.concatenate(regions)
@@ -0,0 +1,205 @@
+"""This module provides spatial index of road segments between route stops."""
+
+import logging
+import threading
+
+import numpy as np
+import pymongo
+
+from app import MONGO_DATABASE
+from app.helpers.easyway_static import get_static_version
+
+
+LOGGER = logging.getLogger(__name__)
+
+EARTH_RADIUS = 6371000  # meters
+SNAP_DISTANCE = 40  # meters
+GRID_CELL_SIZE = 250  # meters
+
+
+def get_segment_id(from_stop_id, to_stop_id):
+    """Return segment id built from its stops ids."""
+    return f"{from_stop_id}-{to_stop_id}"
+
+
+def project(latitudes, longitudes, origin):
+    """Return equirectangular projection of coordinates in meters around origin latitude."""
+    latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+    longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+    x = EARTH_RADIUS * longitudes * np.cos(np.radians(origin))
+    y = EARTH_RADIUS * latitudes
+    return x, y
+
+
+class SegmentIndex:
+    """
+    Grid index of road segments projected to local plane in meters. Every
+    grid cell refers to segments whose bounds expanded by snap distance
+    cover it, so vehicle candidates are taken from its own cell only and
+    distances to candidates are calculated in a single vectorized pass.
+    """
+
+    def __init__(self, segments):
+        self.ids = [segment["_id"] for segment in segments]
+        self.segments = segments
+        self.positions = {segment_id: index for index, segment_id in enumerate(self.ids)}
+
+        coordinates = np.array([x["coordinates"] for x in segments], dtype=np.float64).reshape((-1, 2, 2))
+        self.origin = coordinates[:, :, 0].mean() if len(segments) else 0
+        self.start_x, self.start_y = self.project(coordinates[:, 0, 0], coordinates[:, 0, 1])
+        self.end_x, self.end_y = self.project(coordinates[:, 1, 0], coordinates[:, 1, 1])
+
+        route_ids = sorted({route_id for x in segments for route_id in x["route_ids"]})
+        self.routes_codes = {route_id: code for code, route_id in enumerate(route_ids)}
+        self.route_keys = np.sort(np.array([
+            index * len(route_ids) + self.routes_codes[route_id]
+            for index, segment in enumerate(segments) for route_id in segment["route_ids"]
+        ], dtype=np.int64))
+
+        self._build_grid()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def project(self, latitudes, longitudes):
+        """Return equirectangular projection of coordinates in meters."""
+        return project(latitudes, longitudes, self.origin)
+
+    def _get_cell_keys(self, cells_x, cells_y):
+        """Return flat grid cell keys."""
+        return cells_x * self.grid_height + cells_y
+
+    def _build_grid(self):
+        """Build sorted grid cells referencing segments within snap distance."""
+        min_x = np.floor((np.minimum(self.start_x, self.end_x) - SNAP_DISTANCE) / GRID_CELL_SIZE).astype(np.int64)
+        max_x = np.floor((np.maximum(self.start_x, self.end_x) + SNAP_DISTANCE) / GRID_CELL_SIZE).astype(np.int64)
+        min_y = np.floor((np.minimum(self.start_y, self.end_y) - SNAP_DISTANCE) / GRID_CELL_SIZE).astype(np.int64)
+        max_y = np.floor((np.maximum(self.start_y, self.end_y) + SNAP_DISTANCE) / GRID_CELL_SIZE).astype(np.int64)
+
+        self.grid_x = int(min_x.min()) if len(self) else 0
+        self.grid_y = int(min_y.min()) if len(self) else 0
+        self.grid_height = int(max_y.max()) - self.grid_y + 1 if len(self) else 1
+
+        cell_keys, cell_segments = [], []
+        for index in range(len(self)):
+            cells_x, cells_y = np.meshgrid(
+                np.arange(min_x[index], max_x[index] + 1) - self.grid_x,
+                np.arange(min_y[index], max_y[index] + 1) - self.grid_y
+            )
+            keys = self._get_cell_keys(cells_x.ravel(), cells_y.ravel())
+            cell_keys.append(keys)
+            cell_segments.append(np.full(len(keys), index, dtype=np.int64))
+
+        cell_keys = np.concatenate(cell_keys) if cell_keys else np.zeros(0, dtype=np.int64)
+        cell_segments = np.concatenate(cell_segments) if cell_segments else np.zeros(0, dtype=np.int64)
+        order = np.argsort(cell_keys, kind="stable")
+        self.cell_segments = cell_segments[order]
+        self.cell_keys, self.cell_starts, self.cell_counts = np.unique(
+            cell_keys[order], return_index=True, return_counts=True
+        )
+
+    def snap(self, latitudes, longitudes, route_ids):
+        """
+        Return index of the nearest segment served by vehicle route within
+        snap distance for every vehicle or -1 when there is no such segment.
+        """
+        snapped = np.full(len(route_ids), -1, dtype=np.int64)
+        if not len(self) or not len(route_ids):
+            return snapped
+
+        x, y = self.project(latitudes, longitudes)
+        vehicles, segments = self._get_candidates(x, y)
+        vehicles, segments = self._filter_served(vehicles, segments, route_ids)
+
+        distances = self._get_distances(x[vehicles], y[vehicles], segments)
+        near = distances <= SNAP_DISTANCE
+        vehicles, segments, distances = vehicles[near], segments[near], distances[near]
+
+        order = np.lexsort((distances, vehicles))
+        nearest_vehicles, nearest = np.unique(vehicles[order], return_index=True)
+        snapped[nearest_vehicles] = segments[order][nearest]
+        return snapped
+
+    def _get_candidates(self, x, y):
+        """Return (vehicle, segment) candidate pairs referenced by grid cells of projected vehicles."""
+        cells_x = np.floor(x / GRID_CELL_SIZE).astype(np.int64) - self.grid_x
+        cells_y = np.floor(y / GRID_CELL_SIZE).astype(np.int64) - self.grid_y
+        inside = (cells_x >= 0) & (cells_y >= 0) & (cells_y < self.grid_height)
+        keys = self._get_cell_keys(cells_x, cells_y)
+
+        positions = np.minimum(np.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+        found = np.flatnonzero(inside & (self.cell_keys[positions] == keys))
+        counts = self.cell_counts[positions[found]]
+
+        vehicles = np.repeat(found, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        segments = self.cell_segments[np.repeat(self.cell_starts[positions[found]], counts) + offsets]
+        return vehicles, segments
+
+    def _filter_served(self, vehicles, segments, route_ids):
+        """Return candidate pairs whose segment is served by the vehicle route."""
+        routes_codes = np.fromiter(
+            (self.routes_codes.get(route_id, -1) for route_id in route_ids),
+            dtype=np.int64,
+            count=len(route_ids)
+        )
+        route_keys = segments * len(self.routes_codes) + routes_codes[vehicles]
+        served = routes_codes[vehicles] >= 0
+        served &= np.isin(route_keys, self.route_keys, assume_unique=False)
+        return vehicles[served], segments[served]
+
+    def _get_distances(self, x, y, segments):
+        """Return distances from points to corresponding segments."""
+        start_x, start_y = self.start_x[segments], self.start_y[segments]
+        delta_x, delta_y = self.end_x[segments] - start_x, self.end_y[segments] - start_y
+        length = delta_x ** 2 + delta_y ** 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            projection = ((x - start_x) * delta_x + (y - start_y) * delta_y) / length
+
+        projection = np.clip(np.nan_to_num(projection), 0, 1)
+        return np.hypot(x - start_x - projection * delta_x, y - start_y - projection * delta_y)
+
+
+class SegmentsSnapshot:
+    """
+    Process-wide segment index loaded from `route_segments` collection and
+    reloaded only when the published static version changes.
+    """
+
+    collection = MONGO_DATABASE.route_segments
+
+    def __init__(self):
+        self.version = None
+        self.index = SegmentIndex([])
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Reload segment index if the published static version has changed."""
+        version = get_static_version()
+        if version is None or version == self.version:
+            return False
+
+        with self._lock:
+            if version == self.version:
+                return False
+
+            try:
+                segments = list(self.collection.find(sort=[("_id", pymongo.ASCENDING)]))
+            except pymongo.errors.PyMongoError as err:
+                LOGGER.error("Couldn't retrieve route segments: %s", err)
+                return False
+
+            self.index = SegmentIndex(segments)
+            self.version = version
+
+        LOGGER.info("Loaded %s route segments: %s", len(segments), version)
+        return True
+
+
+SEGMENTS_SNAPSHOT = SegmentsSnapshot()
+
+
+def get_segment_index():
+    """Return segment index of the current static version."""
+    SEGMENTS_SNAPSHOT.refresh()
+    return SEGMENTS_SNAPSHOT.index
@@ -1,26 +1,298 @@
 """This modules provides functionality to work with stops data."""
+import time
 import logging
+import threading
+from datetime import timedelta
 
+import numpy as np
+from bson import Binary
 from pymongo.errors import PyMongoError
 
 from app import MONGO_DATABASE
+from app.helpers.easyway_static import get_static_version, get_active_services
+from app.utils.time import DAY, get_time_string
+from app.helpers.autocomplete import StopAutocomplete
 
 
 LOGGER = logging.getLogger(__name__)
 
+EARTH_RADIUS = 6371000  # meters
+STOPS_GRID_CELL_SIZE = 0.005  # degrees, about 550 m by latitude in Lviv
+STOPS_VERSION_CHECK_INTERVAL = 60  # seconds between static version checks
+
+ARRIVALS_TIMES_DTYPE = np.dtype("<u4")
+ARRIVALS_TRIPS_DTYPE = np.dtype("<u4")
+STOPS_PROJECTION = {"arrivals": 0, "arrivals_trips": 0}  # stop fields without packed arrivals
+
+
+def get_arrivals_routes_dtype(routes_count):
+    """Return dtype of packed route indexes wide enough for stop routes count."""
+    return np.dtype("u1") if routes_count <= 256 else np.dtype("<u2")
+
+
+def pack_arrivals(arrival_times, route_names, trip_indexes):
+    """
+    Return stop arrivals packed into sorted little-endian arrival time
+    integers, route indexes into the small dictionary of stop route names
+    and trip indexes into the dictionary of stop trips.
+    """
+    arrival_times = np.asarray(arrival_times, dtype=np.int64)
+    order = np.argsort(arrival_times, kind="stable")
+    routes, routes_indexes = np.unique(np.asarray(route_names, dtype=object)[order], return_inverse=True)
+    return {
+        "routes": routes.tolist(),
+        "times": Binary(arrival_times[order].astype(ARRIVALS_TIMES_DTYPE).tobytes()),
+        "routes_indexes": Binary(routes_indexes.astype(get_arrivals_routes_dtype(len(routes))).tobytes()),
+        "trips_indexes": Binary(np.asarray(trip_indexes)[order].astype(ARRIVALS_TRIPS_DTYPE).tobytes()),
+    }
+
+
+def unpack_arrivals(arrivals, trips, start, end, limit=None, offset=0):
+    """
+    Decode only packed arrivals within [start, end] time range found by
+    binary search, trip ids are looked up in the stop trips dictionary.
+    Offset shifts the range into the service day time, so arrivals of the
+    previous service day after midnight are decoded with offset of one day
+    and returned in the current day time.
+    """
+    times = np.frombuffer(arrivals["times"], dtype=ARRIVALS_TIMES_DTYPE)
+    routes_dtype = get_arrivals_routes_dtype(len(arrivals["routes"]))
+    first = int(np.searchsorted(times, start + offset, side="left"))
+    last = int(np.searchsorted(times, end + offset, side="right"))
+    if limit is not None:
+        last = min(last, first + max(limit, 0))
+
+    routes_indexes = np.frombuffer(
+        arrivals["routes_indexes"],
+        dtype=routes_dtype,
+        count=last - first,
+        offset=first * routes_dtype.itemsize
+    )
+    trips_indexes = np.frombuffer(
+        arrivals["trips_indexes"],
+        dtype=ARRIVALS_TRIPS_DTYPE,
+        count=last - first,
+        offset=first * ARRIVALS_TRIPS_DTYPE.itemsize
+    )
+    # unsigned times are widened before shift, so previous day arrivals before midnight stay negative
+    arrival_times = times[first:last].astype(np.int64) - offset
+    rows = zip(arrival_times.tolist(), routes_indexes.tolist(), trips_indexes.tolist())
+    return [
+        {
+            "route_name": arrivals["routes"][route_index],
+            "trip_id": trips[trip_index],
+            "arrival_time": get_time_string(arrival_time),
+            "arrival_time_integer": arrival_time
+        }
+        for arrival_time, route_index, trip_index in rows
+    ]
+
+
+def haversine(latitude, longitude, latitudes, longitudes):
+    """Return great circle distances in meters from the point to every coordinate."""
+    latitude, longitude = np.radians(latitude), np.radians(longitude)
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    value = (
+        np.sin((latitudes - latitude) / 2) ** 2 +
+        np.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(value))
+
+
+class StopIndex:
+    """
+    Grid index over stops coordinates. Nearest stops are searched in square
+    rings of grid cells growing around the point until the ring covers the
+    distance to the last requested stop, candidates are ranked by haversine.
+    """
+
+    def __init__(self, stops):
+        self.stops = stops
+        coordinates = np.array([x["coordinates"] for x in stops], dtype=np.float64).reshape(-1, 2)
+        self.latitudes = coordinates[:, 0]
+        self.longitudes = coordinates[:, 1]
+
+        cells = np.floor(coordinates / STOPS_GRID_CELL_SIZE).astype(np.int64)
+        self.cells = {}
+        for index, cell in enumerate(map(tuple, cells.tolist())):
+            self.cells.setdefault(cell, []).append(index)
+        self.cells = {k: np.array(v, dtype=np.int64) for k, v in self.cells.items()}
+
+        self.min_cell = cells.min(axis=0) if len(stops) else np.zeros(2, dtype=np.int64)
+        self.max_cell = cells.max(axis=0) if len(stops) else np.zeros(2, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.stops)
+
+    def _get_ring(self, cell_x, cell_y, radius):
+        """Return stops indexes from cells on the square ring of radius around the cell."""
+        if not radius:
+            cells = [(cell_x, cell_y)]
+        else:
+            cells = [(cell_x + x, cell_y + y) for x in (-radius, radius) for y in range(-radius, radius + 1)]
+            cells += [(cell_x + x, cell_y + y) for x in range(1 - radius, radius) for y in (-radius, radius)]
+
+        return [self.cells[cell] for cell in cells if cell in self.cells]
+
+    def get_nearest(self, latitude, longitude, limit):
+        """Return the nearest stops with distances in meters to provided coordinates."""
+        if not len(self) or limit <= 0:
+            return []
+
+        cell_x = int(np.floor(latitude / STOPS_GRID_CELL_SIZE))
+        cell_y = int(np.floor(longitude / STOPS_GRID_CELL_SIZE))
+        # rings closer than grid bounds are empty
+        min_radius = int(max(
+            0, self.min_cell[0] - cell_x, cell_x - self.max_cell[0],
+            self.min_cell[1] - cell_y, cell_y - self.max_cell[1]
+        ))
+        max_radius = int(max(
+            abs(cell_x - self.min_cell[0]), abs(cell_x - self.max_cell[0]),
+            abs(cell_y - self.min_cell[1]), abs(cell_y - self.max_cell[1])
+        ))
+        # meters covered by one ring in the narrowest (longitude) direction
+        ring_size = np.radians(STOPS_GRID_CELL_SIZE) * EARTH_RADIUS * np.cos(np.radians(abs(latitude) + 1))
+
+        candidates = []
+        for radius in range(min_radius, max_radius + 1):
+            if 8 * radius > len(self.cells):
+                # ring has more cells than the grid, ranking every stop is cheaper
+                candidates, radius = [np.arange(len(self))], max_radius
+            else:
+                candidates.extend(self._get_ring(cell_x, cell_y, radius))
+                if sum(len(x) for x in candidates) < limit and radius < max_radius:
+                    continue
+
+            indexes = np.concatenate(candidates) if candidates else np.zeros(0, dtype=np.int64)
+            distances = haversine(latitude, longitude, self.latitudes[indexes], self.longitudes[indexes])
+            nearest = np.argsort(distances, kind="stable")[:limit]
+            if radius == max_radius or (len(nearest) == limit and distances[nearest[-1]] <= radius * ring_size):
+                return [(self.stops[indexes[x]], float(distances[x])) for x in nearest]
+
+        return []
+
+
+class StopsSnapshot:
+    """
+    Process-wide stops spatial and autocomplete indexes loaded from `stops`
+    collection and reloaded when the published static version changes.
+    Version is checked at most once per interval, so lookups are answered
+    from memory.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.index = None
+        self.autocomplete = None
+        self.services_dates = {}
+        self.checked_at = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Reload stops index if the published static version has changed."""
+        now = time.monotonic()
+        if now - self.checked_at < STOPS_VERSION_CHECK_INTERVAL:
+            return False
+
+        with self._lock:
+            if now - self.checked_at < STOPS_VERSION_CHECK_INTERVAL:
+                return False
+
+            self.checked_at = now
+            version = get_static_version()
+            if version is None or version == self.version:
+                return False
+
+            try:
+                stops = list(Stops.collection.find(projection=STOPS_PROJECTION))
+                services_dates = {x["_id"]: x["services"] for x in Stops.services_dates_collection.find()}
+            except PyMongoError as err:
+                LOGGER.error("Couldn't load stops index: %s", err)
+                return False
+
+            if not stops:
+                return False
+
+            self.index = StopIndex(stops)
+            self.autocomplete = StopAutocomplete(stops)
+            self.services_dates = services_dates
+            self.version = version
+
+        LOGGER.info("Loaded stops index with %s stops: %s", len(stops), version)
+        return True
+
+
+STOPS_SNAPSHOT = StopsSnapshot()
+
+
+def get_stop_index():
+    """Return in-process stops index or None if it isn't loaded."""
+    STOPS_SNAPSHOT.refresh()
+    return STOPS_SNAPSHOT.index
+
+
+def get_stop_autocomplete():
+    """Return in-process stops autocomplete or None if it isn't loaded."""
+    STOPS_SNAPSHOT.refresh()
+    return STOPS_SNAPSHOT.autocomplete
+
+
+def get_service_days(date):
+    """
+    Return (active services, offset) of service days whose arrivals happen
+    at date: the date itself and the previous day with trips after midnight.
+    Services are None when calendar isn't known and every service is active.
+    """
+    STOPS_SNAPSHOT.refresh()
+    services = get_active_services(STOPS_SNAPSHOT.services_dates, date)
+    if services is None:
+        return [(None, 0)]
+
+    return [
+        (services, 0),
+        (get_active_services(STOPS_SNAPSHOT.services_dates, date - timedelta(days=1)), DAY)
+    ]
+
+
+def get_service_days_services(service_days):
+    """Return sorted ids of services active at any of service days or None if every service is active."""
+    active_services = set()
+    for services, _ in service_days:
+        if services is None:
+            return None
+
+        active_services.update(services)
+
+    return sorted(active_services)
+
+
+def get_service_offsets(service_days, service_id):
+    """Return offsets of service days when service is active."""
+    return [offset for services, offset in service_days if services is None or service_id in services]
+
 
 class Stops:
     """Class that provides methods for interaction with traffic timeseries."""
 
     collection = MONGO_DATABASE.stops
+    services_dates_collection = MONGO_DATABASE.services_dates
 
     @classmethod
     def get_nearest_stops(cls, latitude, longitude, limit):
-        """Retrieve the nearest stops to provided coordinates."""
+        """Return the nearest stops to provided coordinates from memory or database."""
+        index = get_stop_index()
+        if index is not None:
+            return [stop for stop, _ in index.get_nearest(latitude, longitude, limit)]
+
+        return cls.find_nearest_stops(latitude, longitude, limit)
+
+    @classmethod
+    def find_nearest_stops(cls, latitude, longitude, limit):
+        """Retrieve the nearest stops to provided coordinates from database."""
         try:
             cursor = cls.collection.find(
                 filter={"coordinates": {"$near": [latitude, longitude]}},
-                projection={"arrivals": 0},
+                projection=STOPS_PROJECTION,
                 limit=limit
             )
         except PyMongoError as err:
@@ -33,27 +305,58 @@ class Stops:
         return list(cursor)
 
     @classmethod
-    def get_stop_by_id(cls, stop_id):
-        """Retrieve the stop by provided id"""
+    def get_stop_arrivals(cls, stop_id, start, end, service_days=((None, 0),), limit=None):
+        """
+        Retrieve stop arrivals of active services within time range. Only
+        arrivals of services active at the service days are retrieved and
+        only the requested slice of them is decoded.
+        """
+        pipeline = [{"$match": {"_id": stop_id}}]
+        active_services = get_service_days_services(service_days)
+        if active_services is not None:
+            pipeline.append({"$project": {"arrivals_trips": 1, "arrivals": {"$filter": {
+                "input": "$arrivals",
+                "cond": {"$in": ["$$this.service_id", active_services]}
+            }}}})
+        else:
+            pipeline.append({"$project": {"arrivals_trips": 1, "arrivals": 1}})
+
         try:
-            result = cls.collection.find_one(filter={"_id": stop_id})
+            result = next(cls.collection.aggregate(pipeline), None)
         except PyMongoError as err:
-            LOGGER.error("Couldn't retrieve stop by id (%s): %s", stop_id, err)
+            LOGGER.error("Couldn't retrieve stop arrivals by id (%s): %s", stop_id, err)
             return None
 
         if result is None:
             LOGGER.error("Couldn't find stop by id (%s)", stop_id)
             return None
 
-        return result
+        arrivals = []
+        for service_arrivals in result["arrivals"]:
+            for offset in get_service_offsets(service_days, service_arrivals["service_id"]):
+                arrivals.extend(unpack_arrivals(
+                    service_arrivals, result["arrivals_trips"], start, end, limit, offset
+                ))
+
+        arrivals.sort(key=lambda x: x["arrival_time_integer"])
+        return arrivals if limit is None else arrivals[:max(limit, 0)]
 
     @classmethod
     def get_stops_by_name(cls, query, limit):
-        """Retrieve the stop by provided id"""
+        """Return stops suggestions by name prefix or similarity from memory or database."""
+        autocomplete = get_stop_autocomplete()
+        if autocomplete is not None:
+            return autocomplete.search(query, limit)
+
+        return cls.find_stops_by_name(query, limit)
+
+    @classmethod
+    def find_stops_by_name(cls, query, limit):
+        """Retrieve stops by provided name from database text index."""
         try:
             cursor = cls.collection.find(
                 filter={"$text":{"$search": query}},
-                projection={"arrivals": 0},
+                projection=STOPS_PROJECTION,
                 limit=limit
             )
         except PyMongoError as err:
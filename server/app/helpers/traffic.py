@@ -1,13 +1,29 @@
 """This modules provides functionality to work with traffic timeseries."""
 
+import json
+import time
 import logging
+from datetime import datetime
 
+import numpy as np
 import pymongo
-
-from app import MONGO_DATABASE, REDIS
-from app.constants import REDIS_ROUTES_MIN_SPEED_KEY
-from app.helpers.outliers import iqr
-from app.utils.time import get_time_range
+from redis.exceptions import RedisError
+
+from app import MONGO_DATABASE, REDIS, APP_CONFIG
+from app.constants import (
+    REDIS_ROUTES_MIN_SPEED_KEY,
+    REDIS_TRAFFIC_LATEST_KEY,
+    REDIS_TRAFFIC_HISTORY_PREFIX,
+    REDIS_SPEED_HISTOGRAM_KEY
+)
+from app.helpers.outliers import weighted_quantiles
+from app.helpers.traffic_batch import (
+    BUCKET_SIZE,
+    COORDINATE_SCALE,
+    SPEED_SCALE,
+    DISTANCE_SCALE
+)
+from app.utils.time import get_time_range, get_expire_at
 
 
 LOGGER = logging.getLogger(__name__)
@@ -15,6 +31,38 @@ LOGGER = logging.getLogger(__name__)
 
 MIN_DISTANCE_CACHE_KEY = "MIN_DISTANCE"
 
+ROLLUP_GRANULARITIES = {
+    "5m": 300,
+    "1h": 3600,
+    "1d": 86400,
+}
+ROLLUP_MAX_DELTAS = [
+    ("5m", 2 * 86400),  # 2 days
+    ("1h", 14 * 86400),  # 2 weeks
+]
+ROLLUP_MAX_GRANULARITY = "1d"
+ROLLUP_RETENTIONS = {
+    "5m": APP_CONFIG.TRAFFIC_ROLLUPS_5M_RETENTION_DAYS * 86400,
+    "1h": APP_CONFIG.TRAFFIC_ROLLUPS_1H_RETENTION_DAYS * 86400,
+}
+
+RAW_RETENTION = APP_CONFIG.TRAFFIC_RAW_RETENTION_DAYS * 86400
+CONGESTION_RETENTION = APP_CONFIG.TRAFFIC_CONGESTION_RETENTION_DAYS * 86400
+
+LATEST_HISTORY_SIZE = 12  # 1 hour of 5 min ticks
+COORDINATES_FALLBACK_DELTA = 86400  # 1 day
+TRAFFIC_BATCH_SIZE = 100  # route hour buckets fetched per cursor batch
+
+SPEED_HISTOGRAM_MAX_SPEED = 150  # km/h, faster speeds fall into the last bin
+MIN_SPEED_QUANTILE = 0.1
+MIN_SPEED_TIMEOUT = 3600  # 1 hour
+
+ROUTE_METRICS = {
+    "avg_speed": ["$speed_sum", "$count"],
+    "trips_count": ["$count", "$ticks"],
+    "avg_distance": ["$distance_sum", "$count"],
+}
+
 
 class Congestion:
     """Class that provides method to work with traffic congestion."""
@@ -28,7 +76,7 @@ class Congestion:
             result = cls.collection.find(
                 filter={"id": region},
                 limit=limit,
-                projection={'_id': 0},
+                projection={"_id": 0, "expire_at": 0},
                 sort=[("timestamp", pymongo.DESCENDING)]
             )
         except pymongo.errors.PyMongoError as err:
@@ -37,141 +85,404 @@ class Congestion:
 
         return list(result)
 
+    @classmethod
+    def delete_expired(cls, timestamp):
+        """Delete congestions older than timestamp that were stored without expiration date."""
+        result = cls.collection.delete_many(
+            {"expire_at": {"$exists": False}, "timestamp": {"$lt": timestamp}}
+        )
+        return result.deleted_count
 
-class Traffic:
-    """Class that provides methods for interaction with traffic timeseries."""
 
-    collection = MONGO_DATABASE.traffic
+class RouteRollups:
+    """
+    Class that provides methods to work with per route time bucket rollups.
+    Every bucket document stores vehicles count, speed sum, distance sum and
+    count of collected ticks for (route_short_name, granularity, timestamp).
+    """
+
+    collection = MONGO_DATABASE.traffic_route_rollups
 
     @staticmethod
-    def _format_timeseries(cursor):
-        """Return format timeseries - timestamp:value."""
-        return [
-            {"timestamp": x["_id"]["timestamp"], "value": x["value"]} for x in cursor
-        ]
+    def get_granularity(delta):
+        """Return the finest rollup granularity suitable for provided delta."""
+        for granularity, max_delta in ROLLUP_MAX_DELTAS:
+            if delta <= max_delta:
+                return granularity
+
+        return ROLLUP_MAX_GRANULARITY
 
     @classmethod
-    def get_traffics(cls, start, end):
-        """Return all traffic data for provided period."""
+    def update(cls, traffic):
+        """Increment rollup buckets of every granularity with collected traffic batch."""
+        operations = []
+        for route_short_name, count, speed_sum, distance_sum in traffic.get_routes_totals():
+            for granularity, bucket_size in ROLLUP_GRANULARITIES.items():
+                bucket = traffic.timestamp - traffic.timestamp % bucket_size
+                update = {"$inc": {
+                    "count": count,
+                    "speed_sum": speed_sum,
+                    "distance_sum": distance_sum,
+                    "ticks": 1
+                }}
+                if granularity in ROLLUP_RETENTIONS:
+                    expire_at = get_expire_at(bucket, ROLLUP_RETENTIONS[granularity])
+                    update["$setOnInsert"] = {"expire_at": expire_at}
+
+                operations.append(pymongo.UpdateOne(
+                    {
+                        "route_short_name": route_short_name,
+                        "granularity": granularity,
+                        "timestamp": bucket
+                    },
+                    update,
+                    upsert=True
+                ))
+
+        if not operations:
+            return 0
+
+        result = cls.collection.bulk_write(operations, ordered=False)
+        return result.upserted_count + result.modified_count
+
+    @classmethod
+    def delete_expired(cls, timestamp):
+        """Delete expired rollup buckets that were stored without expiration date."""
+        deleted = 0
+        for granularity, retention in ROLLUP_RETENTIONS.items():
+            result = cls.collection.delete_many({
+                "granularity": granularity,
+                "expire_at": {"$exists": False},
+                "timestamp": {"$lt": timestamp - retention}
+            })
+            deleted += result.deleted_count
+
+        return deleted
+
+
+class LatestCoordinates:
+    """
+    Class that provides methods to work with latest route coordinates stored
+    in redis: a hash with the newest positions per route and a capped list
+    with short history of positions per route.
+    """
+
+    @staticmethod
+    def get_history_key(route):
+        """Return redis key of route coordinates history."""
+        return f"{REDIS_TRAFFIC_HISTORY_PREFIX}:{route}"
+
+    @classmethod
+    def update(cls, traffic):
+        """Save latest coordinates of every route from collected traffic batch."""
+        pipeline = REDIS.pipeline(transaction=False)
+        for route, coordinates in traffic.get_routes_coordinates().items():
+            if not route:
+                continue
+
+            snapshot = json.dumps({"timestamp": traffic.timestamp, "value": coordinates})
+            history_key = cls.get_history_key(route)
+            pipeline.hset(REDIS_TRAFFIC_LATEST_KEY, route, snapshot)
+            pipeline.lpush(history_key, snapshot)
+            pipeline.ltrim(history_key, 0, LATEST_HISTORY_SIZE - 1)
+
+        pipeline.execute()
+
+    @classmethod
+    def get_route_coordinates(cls, route, history=0):
+        """Retrieve latest route coordinates followed by up to `history` previous ones."""
         try:
-            cursor = cls.collection.find(
-                filter={"timestamp": {"$gte": start, "$lte": end}},
-                projection={"_id": 0},
-            )
-        except pymongo.errors.PyMongoError as err:
-            LOGGER.error(
-                "Couldn't retrieve traffics for period (%s, %s). Error: %s",
-                start, end, err
-            )
+            if history:
+                snapshots = REDIS.lrange(cls.get_history_key(route), 0, history)
+            else:
+                snapshot = REDIS.hget(REDIS_TRAFFIC_LATEST_KEY, route)
+                snapshots = [snapshot] if snapshot else []
+        except RedisError as err:
+            LOGGER.error("Couldn't retrieve latest route coordinates (%s): %s", route, err)
             return None
 
-        return list(cursor)
+        return [json.loads(x) for x in snapshots]
+
+
+class SpeedHistogram:
+    """
+    Class that provides streaming sketch of nonzero vehicles speeds. Speeds
+    are counted in fixed bins of 1 / SPEED_SCALE km/h stored in redis hash,
+    so quantiles are calculated over constant count of bins instead of every
+    speed ever collected.
+    """
+
+    max_bin = SPEED_HISTOGRAM_MAX_SPEED * SPEED_SCALE
 
     @classmethod
-    def get_route_avg_speed(cls, route, delta):
-        """Retrieve aggregated timeseries by route average speed."""
-        start, end = get_time_range(delta)
-        pipeline = [
-            {"$match": {
-                "route_short_name": route,
-                "timestamp": {"$gte": start, "$lte": end}
-            }},
-            {"$group": {
-                "_id": {
-                    "route_short_name": "$route_short_name",
-                    "timestamp": "$timestamp"
+    def update(cls, traffic, mask=None):
+        """Count nonzero speeds of collected traffic batch into histogram bins."""
+        speeds = traffic.speeds if mask is None else traffic.speeds[mask]
+        bins = np.minimum(np.rint(speeds * SPEED_SCALE), cls.max_bin).astype(np.int64)
+        # bin 0 is skipped like in seed script, stored speeds are already rounded to bins
+        counts = np.bincount(bins[bins > 0])
+
+        pipeline = REDIS.pipeline(transaction=False)
+        for speed_bin in np.flatnonzero(counts).tolist():
+            pipeline.hincrby(REDIS_SPEED_HISTOGRAM_KEY, speed_bin, int(counts[speed_bin]))
+
+        pipeline.execute()
+        return int(counts.sum())
+
+    @staticmethod
+    def get_quantile(quantile):
+        """Return speed quantile from histogram or None if histogram is empty."""
+        histogram = REDIS.hgetall(REDIS_SPEED_HISTOGRAM_KEY)
+        if not histogram:
+            return None
+
+        bins = np.fromiter((int(x) for x in histogram), dtype=np.int64, count=len(histogram))
+        counts = np.fromiter((int(x) for x in histogram.values()), dtype=np.int64, count=len(histogram))
+        return float(weighted_quantiles(bins, counts, quantile) / SPEED_SCALE)
+
+
+class TrafficBuckets:
+    """
+    Class that provides methods to work with compact traffic storage. Every
+    document holds packed samples of one route for one hour: offsets from the
+    hour start, vehicle ids, scaled integer coordinates, speeds, bearings,
+    odometers and distances. Static route attributes are stored once.
+    """
+
+    collection = MONGO_DATABASE.traffic_buckets
+
+    @classmethod
+    def update(cls, traffic, mask=None):
+        """Append samples of collected traffic batch to route hour buckets."""
+        operations = []
+        for route in traffic.get_routes_samples(mask):
+            operations.append(pymongo.UpdateOne(
+                {"route_id": route["route_id"], "hour": route["hour"]},
+                {
+                    "$setOnInsert": {
+                        "route_short_name": route["route_short_name"],
+                        "route_type": route["route_type"]
+                    },
+                    "$push": {k: {"$each": v} for k, v in route["samples"].items()},
+                    "$addToSet": {"vehicles": {"$each": route["vehicles"]}}
                 },
-                "value": {"$avg": "$trip_speed"}
-            }},
-            {"$sort": {"_id.timestamp": 1}}
+                upsert=True
+            ))
+
+        if not operations:
+            return 0
+
+        cls.collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    @classmethod
+    def replace(cls, buckets):
+        """Replace route hour buckets with complete ones, inserting missing buckets."""
+        operations = [
+            pymongo.ReplaceOne({"route_id": bucket["route_id"], "hour": bucket["hour"]}, bucket, upsert=True)
+            for bucket in buckets
         ]
-        try:
-            cursor = cls.collection.aggregate(pipeline)
-        except pymongo.errors.PyMongoError as err:
-            LOGGER.error("Couldn't retrieve aggregated timeseries: %s", err)
-            return None
+        if not operations:
+            return 0
 
-        return cls._format_timeseries(cursor)
+        cls.collection.bulk_write(operations, ordered=False)
+        return len(operations)
 
     @classmethod
-    def get_route_trips_count(cls, route, delta):
-        """Retrieve aggregated timeseries by routes trips count."""
-        start, end = get_time_range(delta)
+    def count_samples(cls, start, end):
+        """Return count of samples collected within time range."""
         pipeline = [
-            {"$match": {
-                "route_short_name": route,
-                "timestamp": {"$gte": start, "$lte": end}
-            }},
-            {"$group": {
-                "_id": {
-                    "route_short_name": "$route_short_name",
-                    "timestamp": "$timestamp"
-                },
-                "value": {"$sum": 1}
-            }},
-            {"$sort": {"_id.timestamp": 1}}
+            {"$match": {"hour": {"$gte": start - start % BUCKET_SIZE, "$lte": end}}},
+            {"$project": {"samples": {"$size": {"$filter": {
+                "input": "$t",
+                "cond": {"$and": [
+                    {"$gte": [{"$add": ["$hour", "$$this"]}, start]},
+                    {"$lte": [{"$add": ["$hour", "$$this"]}, end]}
+                ]}
+            }}}}},
+            {"$group": {"_id": None, "samples": {"$sum": "$samples"}}}
         ]
+        result = list(cls.collection.aggregate(pipeline))
+        return result[0]["samples"] if result else 0
+
+    @classmethod
+    def delete(cls, start, end):
+        """Delete buckets that are completely within time range."""
+        result = cls.collection.delete_many(
+            {"hour": {"$gte": start, "$lte": end - BUCKET_SIZE + 1}}
+        )
+        return result.deleted_count
+
+    @classmethod
+    def count_expired(cls, timestamp):
+        """Return count of buckets that ended before timestamp."""
+        return cls.collection.count_documents({"hour": {"$lte": timestamp - BUCKET_SIZE}})
+
+    @staticmethod
+    def iter_documents(bucket, start=None, end=None):
+        """Yield traffic documents unpacked from bucket samples within time range."""
+        hour = bucket["hour"]
+        license_plates = dict(bucket.get("vehicles", []))
+        dates = {}
+        samples = zip(
+            bucket["t"], bucket["v"], bucket["lat"], bucket["lon"],
+            bucket["spd"], bucket["brg"], bucket["odo"], bucket["dst"]
+        )
+        for offset, vehicle_id, latitude, longitude, speed, bearing, odometer, distance in samples:
+            timestamp = hour + offset
+            if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+                continue
+
+            if timestamp not in dates:
+                dates[timestamp] = datetime.fromtimestamp(timestamp).isoformat()
+
+            yield {
+                "route_id": bucket["route_id"],
+                "route_short_name": bucket["route_short_name"],
+                "route_type": bucket["route_type"],
+
+                "trip_latitude": latitude / COORDINATE_SCALE,
+                "trip_longitude": longitude / COORDINATE_SCALE,
+                "trip_vehicle_id": vehicle_id,
+                "trip_license_plate": license_plates.get(vehicle_id, ""),
+                "trip_bearing": bearing,
+                "trip_speed": speed / SPEED_SCALE,
+                "trip_odometer": odometer,
+                "trip_distance": distance / DISTANCE_SCALE,
+
+                "timestamp": timestamp,
+                "date": dates[timestamp]
+            }
+
+
+class TrafficArchives:
+    """
+    Class that provides methods to work with registry of archived traffic.
+    Every document describes uploaded archive: time range, file name, file
+    location and count of archived samples, raw traffic of the range can be
+    purged only when its samples count matches the archived one.
+    """
+
+    collection = MONGO_DATABASE.traffic_archives
+
+    @classmethod
+    def add(cls, start, end, name, location, count):
+        """Register successfully uploaded traffic archive."""
         try:
-            cursor = cls.collection.aggregate(pipeline)
+            cls.collection.update_one(
+                {"start": start, "end": end},
+                {"$set": {
+                    "name": name,
+                    "location": location,
+                    "count": count,
+                    "archived_at": int(time.time())
+                }, "$unset": {"purged_at": ""}},
+                upsert=True
+            )
         except pymongo.errors.PyMongoError as err:
-            LOGGER.error("Couldn't retrieve aggregated timeseries: %s", err)
-            return None
+            LOGGER.error("Couldn't register traffic archive (%s): %s", name, err)
+            return False
+
+        return True
+
+    @classmethod
+    def get_purgeable(cls, timestamp):
+        """Return archives that ended before timestamp and weren't purged yet."""
+        cursor = cls.collection.find(
+            filter={"end": {"$lt": timestamp}, "purged_at": {"$exists": False}},
+            sort=[("start", pymongo.ASCENDING)]
+        )
+        return list(cursor)
+
+    @classmethod
+    def set_purged(cls, archive_id, deleted):
+        """Mark archive raw traffic as purged."""
+        cls.collection.update_one(
+            {"_id": archive_id},
+            {"$set": {"purged_at": int(time.time()), "purged_buckets": deleted}}
+        )
+
+
+class Traffic:
+    """Class that provides methods for interaction with traffic timeseries."""
+
+    collection = TrafficBuckets.collection
 
-        return cls._format_timeseries(cursor)
+    @classmethod
+    def iter_traffics(cls, start, end, batch_size=TRAFFIC_BATCH_SIZE):
+        """Yield traffic data for provided period fetching buckets by batches."""
+        cursor = cls.collection.find(
+            filter={"hour": {"$gte": start - start % BUCKET_SIZE, "$lte": end}},
+            projection={"_id": 0},
+            sort=[("hour", pymongo.ASCENDING)],
+            batch_size=batch_size
+        )
+        for bucket in cursor:
+            yield from TrafficBuckets.iter_documents(bucket, start, end)
 
     @classmethod
-    def get_route_avg_distance(cls, route, delta):
-        """Retrieve aggregated timeseries by routes trip distance."""
-        start, end = get_time_range(delta)
+    def get_traffics(cls, start, end):
+        """Return all traffic data for provided period."""
+        try:
+            return list(cls.iter_traffics(start, end))
+        except pymongo.errors.PyMongoError as err:
+            LOGGER.error(
+                "Couldn't retrieve traffics for period (%s, %s). Error: %s",
+                start, end, err
+            )
+            return None
+
+    @classmethod
+    def get_route_metrics(cls, route, delta, fields=None, end=None):
+        """
+        Retrieve route metrics timeseries for the provided period in one
+        aggregation pass over rollups. Return timestamps and values of every
+        requested metric as aligned arrays.
+        """
+        fields = fields or list(ROUTE_METRICS)
+        start, end = get_time_range(delta, end)
+        granularity = RouteRollups.get_granularity(delta)
+        bucket_size = ROLLUP_GRANULARITIES[granularity]
         pipeline = [
             {"$match": {
                 "route_short_name": route,
-                "timestamp": {"$gte": start, "$lte": end}
+                "granularity": granularity,
+                "timestamp": {"$gte": start - start % bucket_size, "$lte": end}
             }},
+            {"$sort": {"timestamp": 1}},
             {"$group": {
-                "_id": {
-                    "route_short_name": "$route_short_name",
-                    "timestamp": "$timestamp"
-                },
-                "value": {"$avg": "$trip_distance"}
+                "_id": None,
+                "timestamp": {"$push": "$timestamp"},
+                **{
+                    field: {"$push": {"$divide": ROUTE_METRICS[field]}}
+                    for field in fields
+                }
             }},
-            {"$sort": {"_id.timestamp": 1}}
+            {"$project": {"_id": 0}}
         ]
         try:
-            cursor = cls.collection.aggregate(pipeline)
+            cursor = RouteRollups.collection.aggregate(pipeline)
+            result = next(cursor, None)
         except pymongo.errors.PyMongoError as err:
-            LOGGER.error("Couldn't retrieve aggregated timeseries: %s", err)
+            LOGGER.error("Couldn't retrieve route metrics (%s): %s", route, err)
             return None
 
-        return cls._format_timeseries(cursor)
+        if result is None:
+            return {"timestamp": [], **{field: [] for field in fields}}
 
-    @classmethod
-    def get_routes_speeds(cls):
-        """Return all routes speeds for the provided time."""
-        try:
-            cursor = cls.collection.find(
-                filter={"trip_speed": {"$ne": 0}},
-                projection={"_id": 0, "trip_speed": 1}
-            )
-        except pymongo.errors.PyMongoError as err:
-            LOGGER.error("Couldn't retrieve routes speeds: %s", err)
-            return None
-
-        return list(cursor)
+        return result
 
     @classmethod
     def get_routes_min_speed(cls):
-        """Return min routes speed for the provided time."""
+        """Return min routes speed as low quantile of collected speeds."""
         min_speed = REDIS.get(REDIS_ROUTES_MIN_SPEED_KEY)
-        if not min_speed:
-            routes_speeds = cls.get_routes_speeds()
-            if not routes_speeds:
+        if min_speed is None:
+            min_speed = SpeedHistogram.get_quantile(MIN_SPEED_QUANTILE)
+            if min_speed is None:
                 LOGGER.error("Couldn't find min routes speed.")
                 return None
 
-            routes_speeds = iqr([x["trip_speed"] for x in routes_speeds], q1_bound=0.1)
-            min_speed = min(routes_speeds)
-            REDIS.set(REDIS_ROUTES_MIN_SPEED_KEY, min_speed, 24 * 60 * 60)
+            REDIS.set(REDIS_ROUTES_MIN_SPEED_KEY, min_speed, MIN_SPEED_TIMEOUT)
         else:
             min_speed = float(min_speed)
 
@@ -179,41 +490,49 @@ class Traffic:
         return min_speed
 
     @classmethod
-    def get_route_coordinates(cls, route):
-        """Retrieve coordinates for route."""
-        pipeline = [
-            {"$match": {"route_short_name": route}},
-            {"$group": {
-                "_id": {
-                    "route_name": "$route_short_name",
-                    "timestamp": "$timestamp"
-                },
-                "value": {
-                    "$addToSet": {
-                        "latitude": "$trip_latitude",
-                        "longitude": "$trip_longitude"
-                    }
-                }
-            }},
-            {"$sort": {"_id.timestamp": pymongo.DESCENDING}},
-            {"$limit": 1}
-        ]
+    def get_route_coordinates(cls, route, history=0):
+        """Retrieve latest coordinates for route, falling back to the last day of traffic."""
+        snapshots = LatestCoordinates.get_route_coordinates(route, history)
+        if snapshots:
+            return snapshots
+
+        start = time.time() - COORDINATES_FALLBACK_DELTA
         try:
-            cursor = cls.collection.aggregate(pipeline)
+            cursor = cls.collection.find(
+                filter={"route_short_name": route, "hour": {"$gte": start - start % BUCKET_SIZE}},
+                projection={"_id": 0, "hour": 1, "t": 1, "lat": 1, "lon": 1},
+                sort=[("hour", pymongo.DESCENDING)],
+                limit=2
+            )
+            buckets = list(cursor)
         except pymongo.errors.PyMongoError as err:
-            LOGGER.error("Couldn't retrieve aggregated timeseries: %s", err)
+            LOGGER.error("Couldn't retrieve route coordinates (%s): %s", route, err)
             return None
 
-        return cls._format_timeseries(cursor)
+        snapshots = {}
+        for bucket in buckets:
+            for offset, latitude, longitude in zip(bucket["t"], bucket["lat"], bucket["lon"]):
+                coordinates = (latitude / COORDINATE_SCALE, longitude / COORDINATE_SCALE)
+                snapshots.setdefault(bucket["hour"] + offset, {})[coordinates] = None
+
+        timestamps = sorted(snapshots, reverse=True)[:history + 1]
+        return [
+            {
+                "timestamp": timestamp,
+                "value": [{"latitude": x[0], "longitude": x[1]} for x in snapshots[timestamp]]
+            }
+            for timestamp in timestamps
+        ]
 
     @classmethod
-    def get_routes_names(cls, delta):
-        """Retrieve unique route names for the specific period."""
-        start, end = get_time_range(delta)
+    def get_routes_names(cls, delta, end=None):
+        """Retrieve unique route names grouped by route type for the specific period."""
+        start, end = get_time_range(delta, end)
         pipeline = [
             {"$match": {
                 "route_short_name": {"$ne": ""},
-                "timestamp": {"$gte": start, "$lte": end},
+                "hour": {"$gte": start - start % BUCKET_SIZE, "$lte": end},
+                "$expr": {"$gte": [{"$add": ["$hour", {"$max": "$t"}]}, start]},
             }},
             {"$group": {
                 "_id": "$route_type",
@@ -226,4 +545,8 @@ class Traffic:
             LOGGER.error("Couldn't retrieve aggregated timeseries: %s", err)
             return None
 
-        return cursor
+        routes = [
+            {"route_type": x["_id"], "route_names": sorted(x["route_names"])}
+            for x in cursor
+        ]
+        return sorted(routes, key=lambda x: -len(x["route_names"]))
@@ -0,0 +1,270 @@
+"""This module provides columnar representation of collected traffic."""
+
+import sys
+import array
+
+import numpy as np
+
+
+DEFAULT_ROUTE_TYPE = "Інші"
+
+BUCKET_SIZE = 3600  # 1 hour
+COORDINATE_SCALE = 10 ** 6
+SPEED_SCALE = 10
+DISTANCE_SCALE = 10
+
+
+def decode_vehicles(feed):
+    """
+    Decode vehicle entities of GTFS realtime feed message into columns.
+    Return route ids, route codes, interned vehicle ids, license plates and
+    trip ids and numeric columns with speeds converted to km/h.
+    """
+    routes_codes = {}
+    route_codes = array.array("i")
+    vehicle_ids = []
+    license_plates = []
+    trip_ids = []
+    latitudes = array.array("d")
+    longitudes = array.array("d")
+    bearings = array.array("d")
+    speeds = array.array("d")
+    odometers = array.array("d")
+
+    intern = sys.intern
+    for entity in feed.entity:
+        vehicle = entity.vehicle
+        position = vehicle.position
+        descriptor = vehicle.vehicle
+        route_id = vehicle.trip.route_id
+
+        route_code = routes_codes.get(route_id)
+        if route_code is None:
+            route_code = routes_codes[route_id] = len(routes_codes)
+
+        route_codes.append(route_code)
+        vehicle_ids.append(intern(descriptor.id))
+        license_plates.append(intern(descriptor.license_plate.replace("-", "")))
+        trip_ids.append(intern(vehicle.trip.trip_id))
+        latitudes.append(position.latitude)
+        longitudes.append(position.longitude)
+        bearings.append(position.bearing)
+        speeds.append(position.speed)
+        odometers.append(position.odometer)
+
+    columns = {
+        "latitudes": np.frombuffer(latitudes, dtype=np.float64),
+        "longitudes": np.frombuffer(longitudes, dtype=np.float64),
+        "bearings": np.frombuffer(bearings, dtype=np.float64),
+        "speeds": np.frombuffer(speeds, dtype=np.float64) * 3.6,
+        "odometers": np.frombuffer(odometers, dtype=np.float64),
+    }
+    route_codes = np.frombuffer(route_codes, dtype=np.int32)
+    return list(routes_codes), route_codes, vehicle_ids, license_plates, trip_ids, columns
+
+
+def get_distances(odometers, vehicle_ids, prev_odometers):
+    """Return distances passed since previous odometers, zero for vehicles without previous odometer."""
+    prev_odometers = np.fromiter(
+        (prev_odometers.get(vehicle_id, np.nan) for vehicle_id in vehicle_ids),
+        dtype=np.float64,
+        count=len(vehicle_ids)
+    )
+    distances = odometers - prev_odometers
+    distances[np.isnan(distances)] = 0
+    return distances
+
+
+class TrafficBatch:
+    """
+    Struct-of-arrays batch of vehicle positions collected at one timestamp.
+    Numeric fields are stored as numpy arrays, routes are dictionary encoded
+    and string columns are interned, so packed samples are built only when
+    the batch is going to be inserted into the database.
+    """
+
+    def __init__(self, timestamp, routes, route_codes, vehicle_ids, license_plates, trip_ids, columns):
+        self.timestamp = timestamp
+        self.routes = routes
+        self.route_codes = route_codes
+        self.vehicle_ids = vehicle_ids
+        self.license_plates = license_plates
+        self.trip_ids = trip_ids
+
+        self.latitudes = columns["latitudes"]
+        self.longitudes = columns["longitudes"]
+        self.bearings = columns["bearings"]
+        self.speeds = columns["speeds"]
+        self.odometers = columns["odometers"]
+        self.distances = columns["distances"]
+
+    def __len__(self):
+        return len(self.vehicle_ids)
+
+    @classmethod
+    def from_feed(cls, feed, timestamp, prev_odometers, routes_names, routes_types):
+        """Decode vehicle positions from GTFS realtime feed message."""
+        route_ids, route_codes, vehicle_ids, license_plates, trip_ids, columns = decode_vehicles(feed)
+        columns["distances"] = get_distances(columns["odometers"], vehicle_ids, prev_odometers)
+        routes = [
+            (route_id, routes_names.get(route_id, ""), routes_types.get(route_id, DEFAULT_ROUTE_TYPE))
+            for route_id in route_ids
+        ]
+        return cls(timestamp, routes, route_codes, vehicle_ids, license_plates, trip_ids, columns)
+
+    @classmethod
+    def from_documents(cls, timestamp, documents):
+        """Build batch from traffic documents collected at the same timestamp."""
+        routes_codes = {}
+        routes = []
+        route_codes = []
+        for document in documents:
+            route_id = document["route_id"]
+            if route_id not in routes_codes:
+                routes_codes[route_id] = len(routes)
+                routes.append((route_id, document["route_short_name"], document["route_type"]))
+
+            route_codes.append(routes_codes[route_id])
+
+        columns = {
+            column: np.array([x[field] for x in documents], dtype=np.float64)
+            for column, field in (
+                ("latitudes", "trip_latitude"),
+                ("longitudes", "trip_longitude"),
+                ("bearings", "trip_bearing"),
+                ("speeds", "trip_speed"),
+                ("odometers", "trip_odometer"),
+                ("distances", "trip_distance"),
+            )
+        }
+        return cls(
+            timestamp,
+            routes,
+            np.array(route_codes, dtype=np.int32),
+            [x["trip_vehicle_id"] for x in documents],
+            [x["trip_license_plate"] for x in documents],
+            [x.get("trip_id", "") for x in documents],
+            columns
+        )
+
+    def get_routes_samples(self, mask=None):
+        """
+        Return packed samples per route: offsets from the hour bucket start,
+        scaled integer coordinates, speeds, bearings, odometers and distances.
+        """
+        indexes = np.flatnonzero(mask) if mask is not None else np.arange(len(self))
+        vehicle_ids = np.array(self.vehicle_ids, dtype=object)
+        license_plates = np.array(self.license_plates, dtype=object)
+        route_codes = self.route_codes[indexes]
+
+        hour = self.timestamp - self.timestamp % BUCKET_SIZE
+        latitudes = np.rint(self.latitudes * COORDINATE_SCALE).astype(np.int64)
+        longitudes = np.rint(self.longitudes * COORDINATE_SCALE).astype(np.int64)
+        speeds = np.rint(self.speeds * SPEED_SCALE).astype(np.int64)
+        bearings = np.rint(self.bearings).astype(np.int64)
+        odometers = np.rint(self.odometers).astype(np.int64)
+        distances = np.rint(self.distances * DISTANCE_SCALE).astype(np.int64)
+
+        routes_samples = []
+        for route_code in np.unique(route_codes).tolist():
+            route_indexes = indexes[route_codes == route_code]
+            route_id, route_short_name, route_type = self.routes[route_code]
+            routes_samples.append({
+                "route_id": route_id,
+                "route_short_name": route_short_name,
+                "route_type": route_type,
+                "hour": hour,
+                "vehicles": [
+                    list(x) for x in
+                    zip(vehicle_ids[route_indexes], license_plates[route_indexes])
+                ],
+                "samples": {
+                    "t": [self.timestamp - hour] * len(route_indexes),
+                    "v": vehicle_ids[route_indexes].tolist(),
+                    "lat": latitudes[route_indexes].tolist(),
+                    "lon": longitudes[route_indexes].tolist(),
+                    "spd": speeds[route_indexes].tolist(),
+                    "brg": bearings[route_indexes].tolist(),
+                    "odo": odometers[route_indexes].tolist(),
+                    "dst": distances[route_indexes].tolist(),
+                }
+            })
+
+        return routes_samples
+
+    def get_routes_totals(self):
+        """Return vehicles count, speed sum and distance sum per route short name."""
+        names_codes = {}
+        for _, route_short_name, _ in self.routes:
+            names_codes.setdefault(route_short_name, len(names_codes))
+
+        routes_names_codes = np.array(
+            [names_codes[route_short_name] for _, route_short_name, _ in self.routes],
+            dtype=np.int32
+        )
+        codes = routes_names_codes[self.route_codes]
+        counts = np.bincount(codes, minlength=len(names_codes))
+        speeds = np.bincount(codes, weights=self.speeds, minlength=len(names_codes))
+        distances = np.bincount(codes, weights=self.distances, minlength=len(names_codes))
+
+        return [
+            (route_short_name, int(counts[code]), float(speeds[code]), float(distances[code]))
+            for route_short_name, code in names_codes.items()
+        ]
+
+    def get_routes_coordinates(self):
+        """Return unique vehicles coordinates per route short name."""
+        routes_coordinates = {}
+        rows = zip(self.route_codes.tolist(), self.latitudes.tolist(), self.longitudes.tolist())
+        for route_code, latitude, longitude in rows:
+            route_short_name = self.routes[route_code][1]
+            routes_coordinates.setdefault(route_short_name, {})[(latitude, longitude)] = None
+
+        return {
+            route_short_name: [{"latitude": x[0], "longitude": x[1]} for x in coordinates]
+            for route_short_name, coordinates in routes_coordinates.items()
+        }
+
+    def get_positions(self):
+        """Return last position (latitude, longitude) for each vehicle."""
+        return dict(zip(self.vehicle_ids, zip(self.latitudes.tolist(), self.longitudes.tolist())))
+
+    def get_moved_mask(self, prev_positions, tolerance=1e-6):
+        """Return mask of vehicles whose position changed since previous positions."""
+        prev_latitudes = np.fromiter(
+            (prev_positions.get(x, (np.nan, np.nan))[0] for x in self.vehicle_ids),
+            dtype=np.float64,
+            count=len(self)
+        )
+        prev_longitudes = np.fromiter(
+            (prev_positions.get(x, (np.nan, np.nan))[1] for x in self.vehicle_ids),
+            dtype=np.float64,
+            count=len(self)
+        )
+        unchanged = (
+            (np.abs(self.latitudes - prev_latitudes) <= tolerance) &
+            (np.abs(self.longitudes - prev_longitudes) <= tolerance)
+        )
+        return ~unchanged
+
+    def to_compact(self, mask=None):
+        """
+        Return vehicles selected by mask in compact encoding: vehicle id, route
+        short name, latitude, longitude, bearing and speed.
+        """
+        indexes = np.flatnonzero(mask) if mask is not None else range(len(self))
+        return [
+            [
+                self.vehicle_ids[index],
+                self.routes[self.route_codes[index]][1],
+                round(float(self.latitudes[index]), 6),
+                round(float(self.longitudes[index]), 6),
+                int(self.bearings[index]),
+                round(float(self.speeds[index]), 1),
+            ]
+            for index in indexes
+        ]
+
+    def get_odometers(self):
+        """Return last odometer value for each vehicle."""
+        return dict(zip(self.vehicle_ids, self.odometers.tolist()))
@@ -0,0 +1,40 @@
+"""This module provides traffic aggregations cached per collected traffic version."""
+
+from app.utils.cache import cache_result
+from app.utils.time import get_query_window
+from app.helpers.traffic import Traffic, Congestion
+
+
+ROUTE_METRICS_LOCK_TIMEOUT = 60  # 1 min, long windows take a while to aggregate
+ROUTE_METRICS_WAIT_TIMEOUT = 20  # 20 seconds
+
+
+def get_route_metrics(route, delta):
+    """Return cached route metrics for canonical query window."""
+    window = get_query_window(delta)
+    return cache_result(
+        "route_metrics",
+        (route, window.delta, window.end),
+        lambda: Traffic.get_route_metrics(route, window.delta, end=window.end),
+        lock_timeout=ROUTE_METRICS_LOCK_TIMEOUT,
+        wait_timeout=ROUTE_METRICS_WAIT_TIMEOUT
+    )
+
+
+def get_routes_names(delta):
+    """Return cached route names grouped by route type for canonical query window."""
+    window = get_query_window(delta)
+    return cache_result(
+        "routes_names",
+        (window.delta, window.end),
+        lambda: Traffic.get_routes_names(window.delta, end=window.end)
+    )
+
+
+def get_region_congestion(region, limit):
+    """Return cached region congestion."""
+    return cache_result(
+        "region_congestion",
+        (region, limit),
+        lambda: Congestion.get_region_congestion(region, limit)
+    )
@@ -22,6 +22,26 @@ class BaseConfig:
     MONGO_URI = os.environ["MONGO_URI"]
     MONGO_SERVER_TIMEOUT = os.environ.get("MONGO_SERVER_TIMEOUT", 5000)
 
+    # Traffic collection
+    GTFS_VEHICLE_URL = os.environ.get(
+        "GTFS_VEHICLE_URL",
+        "http://track.ua-gis.com/gtfs/lviv/vehicle_position"
+    )
+    # seconds between polls, default is every 5 min by crontab
+    TRAFFIC_POLL_INTERVAL = float(os.environ.get("TRAFFIC_POLL_INTERVAL", 0))
+    # persist only vehicles that moved, it's enabled for high-frequency polling
+    TRAFFIC_PERSIST_MOVED_ONLY = 0 < TRAFFIC_POLL_INTERVAL < 300
+
+    # Traffic retention, raw data is deleted only after it was archived
+    TRAFFIC_RAW_RETENTION_DAYS = int(os.environ.get("TRAFFIC_RAW_RETENTION_DAYS", 28))
+    TRAFFIC_ROLLUPS_5M_RETENTION_DAYS = int(os.environ.get("TRAFFIC_ROLLUPS_5M_RETENTION_DAYS", 7))
+    TRAFFIC_ROLLUPS_1H_RETENTION_DAYS = int(os.environ.get("TRAFFIC_ROLLUPS_1H_RETENTION_DAYS", 90))
+    TRAFFIC_CONGESTION_RETENTION_DAYS = int(os.environ.get("TRAFFIC_CONGESTION_RETENTION_DAYS", 30))
+
+    # Traffic archives, backend is one of: google_drive, local
+    TRAFFIC_ARCHIVE_BACKEND = os.environ.get("TRAFFIC_ARCHIVE_BACKEND", "google_drive")
+    TRAFFIC_ARCHIVE_DIR = os.environ.get("TRAFFIC_ARCHIVE_DIR", os.path.join(ROOT_DIR, "archives"))
+
     # Server
     SERVER_HOST = os.environ.get("SERVER_HOST", "localhost")
     SERVER_PORT = os.environ.get("SERVER_PORT", 5555)
@@ -3,24 +3,52 @@
 import time
 import logging
 import pickle
-import json
-import io
+import zipfile
 from datetime import datetime, timedelta
 
 import requests
 from pymongo.errors import PyMongoError
+from redis.exceptions import RedisError
 from celery.signals import worker_ready
 
 from app import MONGO_DATABASE, CELERY_APP, REDIS, APP_CONFIG
-from app.constants import REDIS_GTFS_ODOMETERS_KEY_KEY
+from app.constants import (
+    REDIS_GTFS_ODOMETERS_KEY_KEY,
+    REDIS_GTFS_POSITIONS_KEY,
+    REDIS_GTFS_FEED_STATE_KEY,
+    REDIS_STATIC_VERSION_KEY
+)
 from app.utils.time import DATE_FORMAT
 from app.utils.misc import download_context, unzip
-from app.helpers.google_drive import GoogleDrive
-from app.helpers.traffic import Traffic
+from app.utils.mongo import STOPS_INDEXES, replace_collection
+from app.utils.cache import get_traffic_version, set_traffic_version
+from app.helpers import traffic_cache
+from app.helpers.live import LiveTraffic
+from app.helpers.feed import FeedFetcher
+from app.helpers.segments import get_segment_index
+from app.helpers.congestion import RoutesCongestion, SegmentsCongestion
+from app.helpers.predictions import StopsPredictions, get_trip_index
+from app.helpers.archive import ARCHIVE_MIMETYPE, ARCHIVE_EXTENSION, spool_ndjson, get_archive_backend
+from app.helpers.traffic import (
+    RAW_RETENTION,
+    CONGESTION_RETENTION,
+    Traffic,
+    TrafficBuckets,
+    TrafficArchives,
+    SpeedHistogram,
+    RouteRollups,
+    LatestCoordinates,
+    Congestion
+)
+from app.helpers.easyway_static import STATIC_SNAPSHOT, STATIC_ZIP_FILE, get_archive_version
 from app.helpers.easyway import (
     get_transport_counts,
-    get_stops_per_routes,
-    get_stops_data,
+    scan_stop_times,
+    iter_stops_documents,
+    iter_segments_documents,
+    iter_trips_documents,
+    iter_services_dates_documents,
+    decode_feed,
     parse_traffic,
     parse_traffic_congestion,
 )
@@ -29,9 +57,12 @@ from app.helpers.easyway import (
 LOGGER = logging.getLogger(__name__)
 
 STATIC_URL = "http://track.ua-gis.com/gtfs/lviv/static.zip"
-VEHICLE_URL = "http://track.ua-gis.com/gtfs/lviv/vehicle_position"
+VEHICLE_URL = APP_CONFIG.GTFS_VEHICLE_URL
+VEHICLE_FEED = FeedFetcher(VEHICLE_URL, REDIS_GTFS_FEED_STATE_KEY)
 GTFS_ODOMETERS_KEY = "GTFS_ODOMETERS"
-STATIC_FILE = f"{APP_CONFIG.STATIC_DIR}/static.zip"
+STOPS_BATCH_SIZE = 500
+TRAFFIC_CACHE_WARM_ROUTES = 10
+TRAFFIC_CACHE_WARM_DELTAS = (3600, 86400)  # 1 hour, 1 day
 
 
 @worker_ready.connect
@@ -42,6 +73,88 @@ def at_start(sender, **kwargs):
         sender.app.send_task("app.tasks.prepare_google_credentials", connection=conn)
 
 
+def load_pickled(key):
+    """Return unpickled redis value or empty dictionary if it's missing or malformed."""
+    try:
+        return pickle.loads(REDIS.get(key))
+    except (TypeError, pickle.UnpicklingError):
+        return {}
+
+
+def update_congestion(traffic, persisted):
+    """Update speed histogram and realtime routes and segments congestion of collected traffic."""
+    try:
+        SpeedHistogram.update(traffic, persisted)
+    except RedisError as err:
+        LOGGER.error("Failed to update speed histogram: %s", err)
+
+    try:
+        RoutesCongestion.update(traffic)
+        SegmentsCongestion.update(traffic, get_segment_index())
+    except RedisError as err:
+        LOGGER.error("Failed to save routes and segments congestion: %s", err)
+
+
+def persist_traffic(traffic, persisted, timestamp):
+    """
+    Insert collected traffic buckets, congestion and route rollups to the
+    database. Return False if traffic buckets couldn't be inserted.
+    """
+    traffic_congestion = parse_traffic_congestion(traffic, timestamp)
+    if not traffic_congestion:
+        LOGGER.error("Failed to calculate traffic congestions.")
+
+    try:
+        TrafficBuckets.update(traffic, persisted)
+        MONGO_DATABASE.traffic_congestion.insert_many(traffic_congestion)
+    except TypeError:
+        # trying to insert empty list of documents
+        pass
+    except PyMongoError as err:
+        LOGGER.error("Failed to insert collected routes: %s", err)
+        return False
+
+    try:
+        RouteRollups.update(traffic)
+    except PyMongoError as err:
+        LOGGER.error("Failed to update traffic route rollups: %s", err)
+
+    return True
+
+
+def publish_traffic(traffic, timestamp, moved):
+    """
+    Publish latest coordinates, stops predictions, traffic version with
+    cache warming and live vehicle positions changes of collected traffic.
+    """
+    try:
+        LatestCoordinates.update(traffic)
+    except RedisError as err:
+        LOGGER.error("Failed to save latest route coordinates: %s", err)
+
+    try:
+        StopsPredictions.update(traffic, get_trip_index())
+    except Exception as err:  # pylint: disable=broad-except
+        # predictions are best effort and must not break collection of the tick
+        LOGGER.error("Failed to publish stops arrivals predictions: %s", err)
+
+    try:
+        traffic_version = set_traffic_version(timestamp)
+    except RedisError as err:
+        LOGGER.error("Failed to set traffic version: %s", err)
+        traffic_version = None
+
+    if traffic_version is not None:
+        routes_totals = sorted(traffic.get_routes_totals(), key=lambda x: -x[1])
+        top_routes = [x[0] for x in routes_totals if x[0]][:TRAFFIC_CACHE_WARM_ROUTES]
+        warm_traffic_cache.delay(top_routes, traffic_version)
+
+    try:
+        LiveTraffic.publish(traffic, moved)
+    except RedisError as err:
+        LOGGER.error("Failed to publish live traffic changes: %s", err)
+
+
 @CELERY_APP.task(
     bind=True,
     default_retry_delay=30,  # 30 seconds for retry delay
@@ -51,42 +164,100 @@ def collect_traffic(self):
     Defines commands to download data about Lviv transport geolocation,
     compile it to the dictionary format and insert it to the database.
     """
-    gtfs_content = download_context(VEHICLE_URL)
-    if not gtfs_content:
+    gtfs = VEHICLE_FEED.fetch()
+    if gtfs is None:
         LOGGER.error("Failed to download file with GTFS data.")
         raise self.retry()
 
-    try:
-        prev_odometers = pickle.loads(REDIS.get(REDIS_GTFS_ODOMETERS_KEY_KEY))
-    except (TypeError, pickle.UnpicklingError):
-        prev_odometers = {}
+    if not gtfs.modified:
+        LOGGER.info("GTFS data hasn't changed since the last collected tick.")
+        return
+
+    feed = decode_feed(gtfs.content)
+    if feed is None:
+        LOGGER.error("Failed to decode GTFS data.")
+        raise self.retry()
+
+    if not VEHICLE_FEED.is_new_header(gtfs, feed.header.timestamp):
+        LOGGER.info("GTFS feed header timestamp hasn't changed since the last collected tick.")
+        VEHICLE_FEED.commit(gtfs)
+        return
+
+    STATIC_SNAPSHOT.refresh()
 
     timestamp = int(time.time())
-    traffic = parse_traffic(gtfs_content, timestamp, prev_odometers)
+    traffic = parse_traffic(feed, timestamp, load_pickled(REDIS_GTFS_ODOMETERS_KEY_KEY))
     if not traffic:
         LOGGER.error("Failed to compile GTFS data to json format.")
         raise self.retry()
 
-    traffic_congestion = parse_traffic_congestion(traffic, timestamp)
-    if not traffic_congestion:
-        LOGGER.error("Failed to calculate traffic congestions.")
+    moved = traffic.get_moved_mask(load_pickled(REDIS_GTFS_POSITIONS_KEY))
+    persisted = moved | (traffic.distances != 0) if APP_CONFIG.TRAFFIC_PERSIST_MOVED_ONLY else None
 
-    try:
-        MONGO_DATABASE.traffic.insert_many(traffic)
-        MONGO_DATABASE.traffic_congestion.insert_many(traffic_congestion)
-    except TypeError:
-        # trying to insert empty list of documents
-        pass
-    except PyMongoError as err:
-        LOGGER.error("Failed to insert collected routes: %s", err)
+    update_congestion(traffic, persisted)
+    if not persist_traffic(traffic, persisted, timestamp):
         raise self.retry()
 
-    traffic_odometers = {x["trip_vehicle_id"]: x["trip_odometer"] for x in traffic}
+    publish_traffic(traffic, timestamp, moved)
+
+    traffic_odometers = traffic.get_odometers()
     REDIS.set(REDIS_GTFS_ODOMETERS_KEY_KEY, pickle.dumps(traffic_odometers), 360)
+    REDIS.set(REDIS_GTFS_POSITIONS_KEY, pickle.dumps(traffic.get_positions()), 360)
+    VEHICLE_FEED.commit(gtfs, feed.header.timestamp)
 
     LOGGER.info("Successfully collected %s trips.", len(traffic))
 
 
+@CELERY_APP.task()
+def warm_traffic_cache(routes, traffic_version):
+    """
+    Pre-compute cached traffic aggregations for the most active
+    routes right after new traffic tick was collected.
+    """
+    if get_traffic_version() != traffic_version:
+        LOGGER.info("Skipped warming outdated traffic cache version %s.", traffic_version)
+        return
+
+    for delta in TRAFFIC_CACHE_WARM_DELTAS:
+        traffic_cache.get_routes_names(delta)
+        for route in routes:
+            traffic_cache.get_route_metrics(route, delta)
+
+    LOGGER.info("Successfully warmed traffic cache for %s routes.", len(routes))
+
+
+def replace_static_collections(easyway_static_data, stops_arrivals, segments_routes, trips_stops):
+    """Replace collections of scanned easyway static data. Return False if any of them failed."""
+    collections = [
+        ("static", "routes", [{"_id": k, "data": v} for k, v in easyway_static_data.items()], {}),
+        (
+            "stops",
+            "stops",
+            iter_stops_documents(stops_arrivals),
+            {"indexes": STOPS_INDEXES, "batch_size": STOPS_BATCH_SIZE}
+        ),
+        ("route_segments", "route segments", iter_segments_documents(segments_routes), {}),
+        ("trip_schedules", "trip schedules", iter_trips_documents(trips_stops), {}),
+    ]
+    for name, description, docs, kwargs in collections:
+        try:
+            replace_collection(MONGO_DATABASE, name, docs, **kwargs)
+        except PyMongoError as err:
+            LOGGER.error("Failed to insert %s easyway static data: %s", description, err)
+            return False
+
+    try:
+        services_dates = replace_collection(MONGO_DATABASE, "services_dates", iter_services_dates_documents())
+        if not services_dates:
+            # feed without services calendar, every service is active every day
+            MONGO_DATABASE.services_dates.drop()
+    except PyMongoError as err:
+        LOGGER.error("Failed to insert services calendar easyway static data: %s", err)
+        return False
+
+    return True
+
+
 @CELERY_APP.task(
     bind=True,
     default_retry_delay=300,  # 5 min for retry delay
@@ -96,58 +267,48 @@ def prepare_easyway_static(self):
     Download and unzip static files from easy way.
     Calculate count transports per agency, transport type
     and certain route, count transport stops routes.
-    Save calculated data to `transport` collection.
+    Save calculated data to `static` collection and full
+    stop times information to `stops` collection.
     """
-    downloaded = download_context(STATIC_URL, STATIC_FILE)
+    downloaded = download_context(STATIC_URL, STATIC_ZIP_FILE)
     if not downloaded:
         LOGGER.error("Failed to download easyway static data.")
         raise self.retry()
 
-    unzipped = unzip(STATIC_FILE, APP_CONFIG.STATIC_DIR)
+    unzipped = unzip(STATIC_ZIP_FILE, APP_CONFIG.STATIC_DIR)
     if not unzipped:
         LOGGER.error("Failed to unzip easyway static data.")
         raise self.retry()
 
+    static_version = get_archive_version()
+    STATIC_SNAPSHOT.load(static_version)
+    if STATIC_SNAPSHOT.version != static_version:
+        LOGGER.error("Failed to load easyway static snapshot.")
+        raise self.retry()
+
+    published_version = REDIS.get(REDIS_STATIC_VERSION_KEY)
+    if published_version and published_version.decode("utf-8") == static_version:
+        LOGGER.info("Easyway static data hasn't changed: %s", static_version)
+        return
+
     transport_counts = get_transport_counts()
-    stops_per_routes = get_stops_per_routes()
+    try:
+        stops_per_routes, stops_arrivals, segments_routes, trips_stops = scan_stop_times()
+    except (OSError, KeyError, zipfile.BadZipFile) as err:
+        LOGGER.error("Failed to parse easyway stop times: %s", err)
+        raise self.retry()
+
     easyway_static_data = {
         "stops_per_routes": stops_per_routes,
         **transport_counts
     }
-
-    docs = [{"_id": k, "data": v} for k, v in easyway_static_data.items()]
-    try:
-        # TODO: transaction
-        MONGO_DATABASE.static.delete_many({})
-        MONGO_DATABASE.static.insert_many(docs)
-    except PyMongoError as err:
-        LOGGER.error("Failed to insert routes easyway static data: %s", err)
+    if not replace_static_collections(easyway_static_data, stops_arrivals, segments_routes, trips_stops):
         raise self.retry()
 
-    prepare_stops_times.delay()
+    REDIS.set(REDIS_STATIC_VERSION_KEY, static_version)
     LOGGER.info("Successfully inserted easyway static data.")
 
 
-@CELERY_APP.task(
-    bind=True,
-    default_retry_delay=300,  # 30 seconds for retry delay
-    retry_kwargs={"max_retries": 2})
-def prepare_stops_times(self):
-    """
-    Parse a couple static files (trips, routes, stops, stop_times) in order
-    to format full stop times information and insert it into stops collection.
-    """
-    stops_times = get_stops_data()
-    docs = [{"_id": k, **v} for k, v in stops_times.items()]
-    try:
-        # TODO: transaction
-        MONGO_DATABASE.stops.delete_many({})
-        MONGO_DATABASE.stops.insert_many(docs)
-    except PyMongoError as err:
-        LOGGER.error("Failed to insert stops easyway static data: %s", err)
-        raise self.retry()
-
-
 @CELERY_APP.task(
     bind=True,
     default_retry_delay=30,  # 30 seconds for retry delay
@@ -185,35 +346,87 @@ def prepare_google_credentials():
     retry_kwargs={"max_retries": 3})
 def dump_traffic(self):
     """
-    Load traffic data for the previous week from the traffic
-    collection and dump it as zip into google drive.
+    Stream traffic data for the previous week from the traffic collection
+    into compressed ndjson file and upload it to the archive backend.
     """
     sunday = datetime.now() - timedelta(days=1)
 
     end = sunday.replace(hour=23, minute=59, second=59, microsecond=0)
     start = end - timedelta(days=7)
 
-    traffics = Traffic.get_traffics(
+    traffics = Traffic.iter_traffics(
         start=int(start.timestamp()),
         end=int(end.timestamp())
     )
-    if not traffics:
+    try:
+        traffics_file, traffics_count = spool_ndjson(traffics)
+    except PyMongoError as err:
+        LOGGER.error("Failed to export traffic: %s", err)
         raise self.retry()
 
-    traffics_json = json.dumps(traffics, ensure_ascii=False)
-    traffics_file = io.BytesIO(traffics_json.encode("utf-8"))
+    with traffics_file:
+        if not traffics_count:
+            raise self.retry()
+
+        traffic_filename = f"{start.strftime(DATE_FORMAT)}_{end.strftime(DATE_FORMAT)}.{ARCHIVE_EXTENSION}"
+        traffic_file_id = get_archive_backend().upload(
+            traffic_filename,
+            traffics_file,
+            ARCHIVE_MIMETYPE
+        )
 
-    traffic_filename = f"{start.strftime(DATE_FORMAT)}_{end.strftime(DATE_FORMAT)}.json"
-    traffic_file_id = GoogleDrive.upload_file(
-        traffic_filename,
-        APP_CONFIG.GOOGLE_DRIVE_DIRECTORY_ID,
-        traffics_file,
-        "application/json"
-    )
     if not traffic_file_id:
         raise self.retry()
 
+    TrafficArchives.add(
+        start=int(start.timestamp()),
+        end=int(end.timestamp()),
+        name=traffic_filename,
+        location=traffic_file_id,
+        count=traffics_count
+    )
+
     LOGGER.info(
-        "Successfully dumped data to google drive for period from %s to %s. File id: %s",
-        start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT), traffic_file_id
+        "Successfully dumped %s traffic records for period from %s to %s. File: %s",
+        traffics_count, start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT), traffic_file_id
     )
+
+
+@CELERY_APP.task(
+    bind=True,
+    default_retry_delay=600,  # 10 min for retry delay
+    retry_kwargs={"max_retries": 2})
+def apply_traffic_retention(self):
+    """
+    Purge raw traffic older than retention period. Raw buckets are deleted
+    only for archived ranges whose samples count still matches the archived
+    one. Rollups and congestions expire by TTL indexes, documents stored
+    before expiration dates were introduced are deleted explicitly.
+    """
+    now = int(time.time())
+    try:
+        archives = TrafficArchives.get_purgeable(now - RAW_RETENTION)
+        for archive in archives:
+            samples = TrafficBuckets.count_samples(archive["start"], archive["end"])
+            if samples != archive["count"]:
+                LOGGER.error(
+                    "Skipped purging traffic archive %s: %s samples stored, %s archived.",
+                    archive["name"], samples, archive["count"]
+                )
+                continue
+
+            deleted = TrafficBuckets.delete(archive["start"], archive["end"])
+            TrafficArchives.set_purged(archive["_id"], deleted)
+            LOGGER.info("Purged %s traffic buckets archived in %s.", deleted, archive["name"])
+
+        unarchived = TrafficBuckets.count_expired(now - RAW_RETENTION)
+        rollups = RouteRollups.delete_expired(now)
+        congestions = Congestion.delete_expired(now - CONGESTION_RETENTION)
+    except PyMongoError as err:
+        LOGGER.error("Failed to apply traffic retention: %s", err)
+        raise self.retry()
+
+    if unarchived:
+        LOGGER.warning("%s traffic buckets are older than retention but not archived.", unarchived)
+
+    LOGGER.info("Deleted %s expired rollups and %s expired congestions.", rollups, congestions)
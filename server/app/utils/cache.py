@@ -0,0 +1,155 @@
+"""This module provides versioned redis cache shared by server and worker."""
+
+import time
+import pickle
+import logging
+
+from redis.exceptions import RedisError
+
+from app import REDIS
+from app.constants import (
+    REDIS_CACHE_PREFIX,
+    REDIS_CACHE_METRICS_KEY,
+    REDIS_TRAFFIC_VERSION_KEY
+)
+from app.utils.time import COLLECT_INTERVAL
+
+
+LOGGER = logging.getLogger(__name__)
+
+CACHE_TIMEOUT = COLLECT_INTERVAL  # versioned keys outlive one traffic tick only
+CACHE_STALE_TIMEOUT = 86400  # 1 day
+CACHE_LOCK_TIMEOUT = 30  # 30 seconds
+CACHE_WAIT_TIMEOUT = 10  # 10 seconds
+CACHE_WAIT_INTERVAL = 0.05  # 50 ms
+
+
+def get_traffic_version():
+    """Return version of collected traffic data."""
+    try:
+        version = REDIS.get(REDIS_TRAFFIC_VERSION_KEY)
+    except RedisError as err:
+        LOGGER.error("Couldn't retrieve traffic version: %s", err)
+        return 0
+
+    return int(version or 0)
+
+
+def set_traffic_version(timestamp):
+    """
+    Set version of collected traffic data to the collect interval of the
+    timestamp, so frequent polls within one persisted tick share the cached
+    results. Return new version or None if it hasn't changed.
+    """
+    version = timestamp // COLLECT_INTERVAL
+    previous = REDIS.getset(REDIS_TRAFFIC_VERSION_KEY, version)
+    return version if int(previous or 0) != version else None
+
+
+def get_cache_metrics():
+    """Return cache events counters per cached result name."""
+    try:
+        metrics = REDIS.hgetall(REDIS_CACHE_METRICS_KEY)
+    except RedisError as err:
+        LOGGER.error("Couldn't retrieve cache metrics: %s", err)
+        return None
+
+    return {k.decode("utf-8"): int(v) for k, v in metrics.items()}
+
+
+def _track(name, event):
+    """Increment cache event counter for cached result name."""
+    try:
+        REDIS.hincrby(REDIS_CACHE_METRICS_KEY, f"{name}:{event}")
+    except RedisError as err:
+        LOGGER.error("Couldn't track cache event (%s:%s): %s", name, event, err)
+
+
+def _load(key):
+    """Return unpickled cached value or None if it is absent."""
+    cached = REDIS.get(key)
+    return pickle.loads(cached) if cached is not None else None
+
+
+def _wait(key, wait_timeout):
+    """Poll cache key until value appears or wait timeout expires."""
+    deadline = time.monotonic() + wait_timeout
+    while time.monotonic() < deadline:
+        time.sleep(CACHE_WAIT_INTERVAL)
+        result = _load(key)
+        if result is not None:
+            return result
+
+    return None
+
+
+def _release(name, lock):
+    """Release lock only if it's still owned, lock expired by timeout may be taken by another worker."""
+    try:
+        lock.release()
+    except RedisError as err:
+        LOGGER.warning("Couldn't release cache lock (%s): %s", name, err)
+
+
+def _compute(name, func, keys, timeout):
+    """Compute result and save it as current and stale cached value."""
+    key, stale_key = keys
+    result = func()
+    if result is None:
+        return None
+
+    pickled = pickle.dumps(result)
+    try:
+        pipeline = REDIS.pipeline()
+        pipeline.set(key, pickled, timeout)
+        pipeline.set(stale_key, pickled, CACHE_STALE_TIMEOUT)
+        pipeline.execute()
+    except RedisError as err:
+        LOGGER.error("Couldn't save cached result (%s): %s", name, err)
+
+    return result
+
+
+def cache_result(name, args, func, timeout=CACHE_TIMEOUT,
+                 lock_timeout=CACHE_LOCK_TIMEOUT, wait_timeout=CACHE_WAIT_TIMEOUT):
+    """
+    Return result cached by name and arguments at current traffic version.
+    On a miss only one caller computes the result under short redis lock
+    (single-flight), others serve the previous version of the result if
+    it exists or wait for the fresh one up to wait timeout.
+    """
+    base_key = f"{REDIS_CACHE_PREFIX}:{name}:" + ":".join(str(x) for x in args)
+    key = f"{base_key}:{get_traffic_version()}"
+    keys = (key, f"{base_key}:stale")
+    lock_key = f"{key}:lock"
+
+    try:
+        result = _load(key)
+        if result is not None:
+            _track(name, "hit")
+            return result
+
+        lock = REDIS.lock(lock_key, timeout=lock_timeout)
+        if lock.acquire(blocking=False):
+            _track(name, "miss")
+            try:
+                return _compute(name, func, keys, timeout)
+            finally:
+                _release(name, lock)
+
+        result = _load(keys[1])
+        if result is not None:
+            _track(name, "stale")
+            return result
+
+        result = _wait(key, wait_timeout)
+        if result is not None:
+            _track(name, "wait")
+            return result
+    except RedisError as err:
+        LOGGER.error("Couldn't retrieve cached result (%s): %s", name, err)
+        return func()
+
+    _track(name, "timeout")
+    LOGGER.warning("Timed out waiting for cached result (%s), computing it.", name)
+    return _compute(name, func, keys, timeout)
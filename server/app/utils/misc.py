@@ -1,8 +1,11 @@
 """This module provides helper functionality for collector application."""
 
+import io
 import csv
 import zipfile
 import json
+import hashlib
+import itertools
 from http import HTTPStatus
 
 import requests
@@ -45,6 +48,23 @@ def load_csv(filepath, delimiter=','):
     return output
 
 
+def iter_zip_csv(zippath, filename, delimiter=','):
+    """Yield rows of csv file stored in zip archive without extracting it."""
+    with zipfile.ZipFile(zippath, "r") as zip_file:
+        with zip_file.open(filename) as csv_file:
+            csv_text = io.TextIOWrapper(csv_file, encoding="utf-8")
+            yield from csv.DictReader(csv_text, delimiter=delimiter)
+
+
+def chunked(iterable, size):
+    """Yield lists with at most `size` items from iterable."""
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
 def load_json(filepath):
     """Return parsed json file as dictionary."""
     with open(filepath) as json_file:
@@ -65,3 +85,13 @@ def unzip(zippath, dirpath):
         return False
 
     return True
+
+
+def get_file_hash(filepath, chunk_size=65536):
+    """Return sha256 hex digest of file content."""
+    file_hash = hashlib.sha256()
+    with open(filepath, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
@@ -0,0 +1,38 @@
+"""This module provides helper functionality to work with mongo collections."""
+
+import pymongo
+
+from app.utils.misc import chunked
+
+
+SHADOW_COLLECTION_SUFFIX = "_shadow"
+
+STOPS_COORDINATES_INDEX_NAME = "stops_coordinates_index"
+STOPS_NAMES_INDEX_NAME = "stops_names_index"
+STOPS_INDEXES = [
+    ([("coordinates", pymongo.GEO2D)], STOPS_COORDINATES_INDEX_NAME),
+    ([("stop_name", pymongo.TEXT), ("stop_desc", pymongo.TEXT)], STOPS_NAMES_INDEX_NAME),
+]
+
+
+def replace_collection(database, name, documents, indexes=(), batch_size=500):
+    """
+    Build documents into a shadow collection, create its indexes and rename
+    it over the target collection, so readers never see partial data.
+    """
+    shadow = database[f"{name}{SHADOW_COLLECTION_SUFFIX}"]
+    shadow.drop()
+
+    inserted = 0
+    for chunk in chunked(documents, batch_size):
+        shadow.insert_many(chunk)
+        inserted += len(chunk)
+
+    if not inserted:
+        return 0
+
+    for index, index_name in indexes:
+        shadow.create_index(index, name=index_name)
+
+    shadow.rename(name, dropTarget=True)
+    return inserted
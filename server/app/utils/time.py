@@ -1,20 +1,77 @@
 """This module provides helper functionality for collector application."""
 
+import collections
 from datetime import datetime
 
 
 TIME_FORMAT = "%H:%M:%S"
 DATE_FORMAT = "%Y-%m-%d"
 
+DAY = 86400  # seconds
+COLLECT_INTERVAL = 300  # 5 min
+SUPPORTED_DELTAS = (
+    3600,  # 1 hour
+    3 * 3600,
+    6 * 3600,
+    12 * 3600,
+    86400,  # 1 day
+    3 * 86400,
+    7 * 86400,
+    14 * 86400,
+    30 * 86400,
+)
 
-def get_time_range(delta):
-    """Return time range by delta."""
-    end = datetime.now().timestamp()
+QueryWindow = collections.namedtuple("QueryWindow", ["delta", "start", "end"])
+
+
+def get_canonical_delta(delta):
+    """Return the smallest supported delta that covers requested one."""
+    for supported_delta in SUPPORTED_DELTAS:
+        if delta <= supported_delta:
+            return supported_delta
+
+    return SUPPORTED_DELTAS[-1]
+
+
+def get_window_end():
+    """Return the end of current collection interval."""
+    now = int(datetime.now().timestamp())
+    return now - now % COLLECT_INTERVAL + COLLECT_INTERVAL
+
+
+def get_query_window(delta):
+    """Return canonical delta and time range aligned to the collection interval."""
+    delta = get_canonical_delta(delta)
+    end = get_window_end()
+    return QueryWindow(delta, end - delta, end)
+
+
+def get_time_range(delta, end=None):
+    """Return time range by delta ending at provided or current window end."""
+    end = end or get_window_end()
     start = end - delta
     return start, end
 
 
+def get_expire_at(timestamp, retention):
+    """Return UTC datetime when document with provided timestamp should expire."""
+    return datetime.utcfromtimestamp(timestamp + retention)
+
+
 def get_time_integer(time):
     """Return time as integer value."""
     hours, minutes, seconds = time.split(":")
     return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def get_time_string(time_integer):
+    """
+    Return time integer value formatted as HH:MM:SS string, negative values
+    of the previous day are formatted as the time of that day.
+    """
+    if time_integer < 0:
+        time_integer += DAY
+
+    hours, rest = divmod(time_integer, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
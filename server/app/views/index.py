@@ -5,6 +5,7 @@ from http import HTTPStatus
 from flask import Blueprint, request
 
 from app.utils.misc import make_response
+from app.utils.cache import get_cache_metrics
 
 
 internal_blueprint = Blueprint('traffic-stuck-internal', __name__)
@@ -16,6 +17,17 @@ def get_health():
     return make_response(True, "OK", HTTPStatus.OK)
 
 
+@internal_blueprint.route("/health/cache", methods=['GET'])
+def get_cache_health():
+    """Return cache events counters per cached result."""
+    metrics = get_cache_metrics()
+    if metrics is None:
+        message = "Couldn't retrieve cache metrics. Try again, please."
+        return make_response(False, message, HTTPStatus.BAD_REQUEST)
+
+    return make_response(True, metrics, HTTPStatus.OK)
+
+
 def handle_404(error):
     """Return custom response for 404 http status code."""
     return make_response(
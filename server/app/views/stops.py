@@ -1,5 +1,6 @@
 """This module provides API views for timeseries data."""
 
+import time
 from http import HTTPStatus
 from datetime import datetime
 
@@ -7,11 +8,15 @@ from flask import Blueprint, request
 
 from app.utils.time import TIME_FORMAT, get_time_integer
 from app.utils.misc import make_response
-from app.helpers.stops import Stops
+from app.helpers.stops import Stops, get_service_days
+from app.helpers.predictions import MAX_DELAY, StopsPredictions, merge_predictions
 
 
 stops_blueprint = Blueprint('traffic-stuck-stops', __name__)
 
+ARRIVALS_WINDOW = 3600  # 1 hour
+ARRIVALS_MAX_WINDOW = 86400  # 1 day
+
 
 @stops_blueprint.route("stops/nearest", methods=["GET"])
 def get_nearest_stops():
@@ -33,17 +38,28 @@ def get_nearest_stops():
 
 @stops_blueprint.route("stops/<stop_id>/arrivals", methods=["GET"])
 def get_nearest_arrivals(stop_id):
-    """Return the nearest arrivals for provided stop id."""
-    stop = Stops.get_stop_by_id(stop_id)
-    if stop is None:
+    """Return the nearest arrivals within time window completed with realtime predictions."""
+    window = request.args.get("window", type=int, default=ARRIVALS_WINDOW)
+    window = min(max(window, 0), ARRIVALS_MAX_WINDOW)
+    limit = request.args.get("limit", type=int)
+
+    now = datetime.now()
+    time_start = get_time_integer(now.strftime(TIME_FORMAT))
+    time_end = time_start + window
+    # late and early vehicles may move scheduled arrivals into the window
+    arrivals = Stops.get_stop_arrivals(
+        stop_id,
+        time_start - MAX_DELAY,
+        time_end + MAX_DELAY,
+        service_days=get_service_days(now.date())
+    )
+    if arrivals is None:
         message = "Couldn't retrieve data from database. Try again, please."
         return make_response(False, message, HTTPStatus.BAD_REQUEST)
 
-    time_start = get_time_integer(datetime.now().strftime(TIME_FORMAT))
-    time_end = time_start + 3600
-    nearest_arrivals = filter(lambda x: time_start <= x["arrival_time_integer"] <= time_end, stop["arrivals"])
-
-    return make_response(True, list(nearest_arrivals), HTTPStatus.OK)
+    predictions = StopsPredictions.get(stop_id) or []
+    nearest_arrivals = merge_predictions(arrivals, predictions, time_start, time_end, limit)
+    return make_response(True, nearest_arrivals, HTTPStatus.OK)
 
 
 @stops_blueprint.route("stops", methods=["GET"])
@@ -52,9 +68,13 @@ def get_stops():
     query = request.args.get("query", "")
     limit = request.args.get("limit", type=int, default=10)
 
+    started = time.perf_counter()
     stops = Stops.get_stops_by_name(query, limit)
+    duration = (time.perf_counter() - started) * 1000
     if stops is None:
         message = "Couldn't retrieve data from database. Try again, please."
         return make_response(False, message, HTTPStatus.BAD_REQUEST)
 
-    return make_response(True, stops, HTTPStatus.OK)
+    response, status_code = make_response(True, stops, HTTPStatus.OK)
+    response.headers["Server-Timing"] = f"search;dur={duration:.3f}"
+    return response, status_code
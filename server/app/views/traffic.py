@@ -1,102 +1,240 @@
 """This module provides API views for timeseries data."""
 
+import json
+import time
+import queue
 from urllib import parse
 from http import HTTPStatus
 
-from flask import Blueprint, request
+from flask import Blueprint, Response, request, stream_with_context
 
-from app import CACHE
 from app.utils.misc import make_response
-from app.helpers.traffic import Traffic, Congestion
+from app.helpers import traffic_cache
+from app.helpers.live import LIVE_TRAFFIC_READER, LiveTraffic, get_entry_key
+from app.helpers.segments import get_segment_index
+from app.helpers.congestion import RoutesCongestion, SegmentsCongestion
+from app.helpers.traffic import ROUTE_METRICS, LATEST_HISTORY_SIZE, Traffic
 
 
 traffic_blueprint = Blueprint('traffic-stuck-traffic', __name__)
 
+STREAM_MAX_DURATION = 600  # 10 min, clients reconnect using Last-Event-ID
+STREAM_RETRY_TIMEOUT = 5000  # 5 seconds in ms
+STREAM_KEEPALIVE_TIMEOUT = 15  # 15 seconds
 
-@traffic_blueprint.route("traffic/<route>/avg_speed", methods=["GET"])
-@CACHE.cached()
-def get_route_avg_speed(route):
-    """Return aggregated routes timeseries by avg speed."""
+
+def get_request_delta():
+    """Return requested query delta."""
+    return request.args.get("delta", type=float, default=3600)
+
+
+def get_request_bbox():
+    """Return requested bounding box, empty list if it's malformed or None if it isn't provided."""
+    bbox = request.args.get("bbox")
+    if not bbox:
+        return None
+
+    try:
+        bbox = [float(x) for x in bbox.split(",")]
+    except ValueError:
+        return []
+
+    return bbox if len(bbox) == 4 else []
+
+
+def get_route_metric_timeseries(route, metric):
+    """Return json response with single route metric timeseries."""
     route = parse.unquote(route, encoding="utf-8")
-    delta = request.args.get("delta", type=float, default=3600)
-    timeseries = Traffic.get_route_avg_speed(route, delta)
-    if timeseries is None:
+    metrics = traffic_cache.get_route_metrics(route, get_request_delta())
+    if metrics is None:
         message = "Couldn't retrieve data from database. Try again, please."
         return make_response(False, message, HTTPStatus.BAD_REQUEST)
 
+    timeseries = [
+        {"timestamp": timestamp, "value": value}
+        for timestamp, value in zip(metrics["timestamp"], metrics[metric])
+    ]
     return make_response(True, timeseries, HTTPStatus.OK)
 
 
-@traffic_blueprint.route("traffic/<route>/trips_count", methods=["GET"])
-@CACHE.cached()
-def get_route_trips_count(route):
-    """Return aggregated routes timeseries by trips count."""
+@traffic_blueprint.route("traffic/<route>/metrics", methods=["GET"])
+def get_route_metrics(route):
+    """Return aggregated route metrics timeseries as aligned arrays."""
     route = parse.unquote(route, encoding="utf-8")
-    delta = request.args.get("delta", type=float, default=3600)
-    timeseries = Traffic.get_route_trips_count(route, delta)
-    if timeseries is None:
+    # empty or blank fields param requests every metric
+    fields = [x.strip() for x in request.args.get("fields", "").split(",") if x.strip()] or list(ROUTE_METRICS)
+    unknown_fields = [field for field in fields if field not in ROUTE_METRICS]
+    if unknown_fields:
+        message = f"The unknown metrics were requested: {', '.join(unknown_fields)}."
+        return make_response(False, message, HTTPStatus.BAD_REQUEST)
+
+    metrics = traffic_cache.get_route_metrics(route, get_request_delta())
+    if metrics is None:
         message = "Couldn't retrieve data from database. Try again, please."
         return make_response(False, message, HTTPStatus.BAD_REQUEST)
 
-    return make_response(True, timeseries, HTTPStatus.OK)
+    result = {"timestamp": metrics["timestamp"], **{field: metrics[field] for field in fields}}
+    return make_response(True, result, HTTPStatus.OK)
+
+
+@traffic_blueprint.route("traffic/<route>/avg_speed", methods=["GET"])
+def get_route_avg_speed(route):
+    """Return aggregated routes timeseries by avg speed."""
+    return get_route_metric_timeseries(route, "avg_speed")
+
+
+@traffic_blueprint.route("traffic/<route>/trips_count", methods=["GET"])
+def get_route_trips_count(route):
+    """Return aggregated routes timeseries by trips count."""
+    return get_route_metric_timeseries(route, "trips_count")
 
 
 @traffic_blueprint.route("traffic/<route>/avg_distance", methods=["GET"])
-@CACHE.cached()
 def get_route_avg_distance(route):
     """Return aggregated routes timeseries by avg_distance."""
-    route = parse.unquote(route, encoding="utf-8")
-    delta = request.args.get("delta", type=float, default=3600)
-    timeseries = Traffic.get_route_avg_distance(route, delta)
-    if timeseries is None:
-        message = "Couldn't retrieve data from database. Try again, please."
-        return make_response(False, message, HTTPStatus.BAD_REQUEST)
-
-    return make_response(True, timeseries, HTTPStatus.OK)
+    return get_route_metric_timeseries(route, "avg_distance")
 
 
 @traffic_blueprint.route("traffic/<route>/coordinates", methods=["GET"])
-@CACHE.cached()
 def get_route_coordinates(route):
-    """Return route coordinates for the last collected time."""
+    """Return route coordinates for the last collected time and optional short history."""
     route = parse.unquote(route, encoding="utf-8")
-    timeseries = Traffic.get_route_coordinates(route)
+    history = request.args.get("history", type=int, default=0)
+    history = min(max(history, 0), LATEST_HISTORY_SIZE - 1)
+    timeseries = Traffic.get_route_coordinates(route, history)
     if timeseries is None:
         message = "Couldn't retrieve data from database. Try again, please."
         return make_response(False, message, HTTPStatus.BAD_REQUEST)
 
+    if history:
+        return make_response(True, timeseries, HTTPStatus.OK)
+
     coordinates = timeseries[0] if timeseries else None
     return make_response(True, coordinates, HTTPStatus.OK)
 
 
 @traffic_blueprint.route("traffic/routes", methods=['GET'])
-@CACHE.cached()
 def get_routes_names():
     """Return json response with available routes from easyway for last period."""
-    delta = request.args.get("delta", type=float, default=3600)
-    result = Traffic.get_routes_names(delta)
-    if result is None:
+    routes = traffic_cache.get_routes_names(get_request_delta())
+    if routes is None:
         message = "Couldn't retrieve data from database. Try again, please."
         return make_response(False, message, HTTPStatus.BAD_REQUEST)
 
-    routes = []
-    for route in result:
-        route_names = sorted(route["route_names"])
-        routes.append({"route_type": route["_id"], "route_names": route_names})
-
-    routes = sorted(routes, key=lambda x: -len(x["route_names"]))
     return make_response(True, routes, HTTPStatus.OK)
 
 
+@traffic_blueprint.route("traffic/live/congestion/routes", methods=["GET"])
+def get_routes_congestion():
+    """Return the latest congestion of every route against its speed baseline."""
+    result = RoutesCongestion.get()
+    if result is None:
+        message = "Couldn't retrieve routes congestion. Try again, please."
+        return make_response(False, message, HTTPStatus.BAD_REQUEST)
+
+    return make_response(True, result, HTTPStatus.OK)
+
+
+@traffic_blueprint.route("traffic/live/congestion/routes/<route>", methods=["GET"])
+def get_route_congestion(route):
+    """Return the latest congestion of the route against its speed baseline."""
+    route = parse.unquote(route, encoding="utf-8")
+    result = RoutesCongestion.get(route)
+    if result is None:
+        message = "Couldn't retrieve route congestion. Try again, please."
+        return make_response(False, message, HTTPStatus.BAD_REQUEST)
+
+    return make_response(True, result, HTTPStatus.OK)
+
+
+@traffic_blueprint.route("traffic/live/congestion/segments", methods=["GET"])
+def get_segments_congestion():
+    """Return the latest congestion of road segments filtered by route or bbox."""
+    bbox = get_request_bbox()
+    if bbox == []:
+        message = "The bbox param should be provided as min_lat,min_lon,max_lat,max_lon."
+        return make_response(False, message, HTTPStatus.BAD_REQUEST)
+
+    result = SegmentsCongestion.get(get_segment_index(), request.args.get("route"), bbox)
+    if result is None:
+        message = "Couldn't retrieve segments congestion. Try again, please."
+        return make_response(False, message, HTTPStatus.BAD_REQUEST)
+
+    return make_response(True, result, HTTPStatus.OK)
+
+
 @traffic_blueprint.route("traffic/congestion/<region>", methods=['GET'])
-@CACHE.cached()
 def get_regions_congestion(region):
     """Return city region traffic congestion."""
     region = parse.unquote(region, encoding="utf-8")
     limit = request.args.get("limit", type=int, default=15)
-    result = Congestion.get_region_congestion(region, limit)
+    result = traffic_cache.get_region_congestion(region, limit)
     if result is None:
         message = "Couldn't retrieve data from database. Try again, please."
         return make_response(False, message, HTTPStatus.BAD_REQUEST)
 
     return make_response(True, result, HTTPStatus.OK)
+
+
+def get_stream_events(entries, route, bbox):
+    """Return server-sent events of stream entries with vehicles filtered by route and bbox."""
+    events = []
+    for entry_id, timestamp, vehicles in entries:
+        vehicles = LiveTraffic.filter_vehicles(vehicles, route, bbox)
+        if vehicles:
+            data = json.dumps({"timestamp": timestamp, "vehicles": vehicles}, ensure_ascii=False)
+            events.append(f"id: {entry_id}\nevent: vehicles\ndata: {data}\n\n")
+
+    return events
+
+
+@traffic_blueprint.route("traffic/stream", methods=["GET"])
+def get_traffic_stream():
+    """Stream vehicle positions changes filtered by route or bbox as server-sent events."""
+    route = request.args.get("route")
+    bbox = get_request_bbox()
+    if bbox == []:
+        message = "The bbox param should be provided as min_lat,min_lon,max_lat,max_lon."
+        return make_response(False, message, HTTPStatus.BAD_REQUEST)
+
+    subscriber = LIVE_TRAFFIC_READER.subscribe()
+    if subscriber is None:
+        message = "Too many live traffic streams are open. Try again later, please."
+        return make_response(False, message, HTTPStatus.SERVICE_UNAVAILABLE)
+
+    def generate(last_id):
+        yield f"retry: {STREAM_RETRY_TIMEOUT}\n\n"
+
+        if last_id is not None:
+            entries = LiveTraffic.read(last_id, block=None)
+            if entries is None:
+                last_id = None
+            elif entries:
+                last_id = entries[-1][0]
+                yield from get_stream_events(entries, route, bbox)
+
+        deadline = time.monotonic() + STREAM_MAX_DURATION
+        while time.monotonic() < deadline:
+            try:
+                entries = subscriber.get(timeout=STREAM_KEEPALIVE_TIMEOUT)
+            except queue.Empty:
+                if subscriber not in LIVE_TRAFFIC_READER:
+                    return
+
+                yield ": keepalive\n\n"
+                continue
+
+            if last_id is not None:
+                entries = [x for x in entries if get_entry_key(x[0]) > get_entry_key(last_id)]
+            if entries:
+                last_id = entries[-1][0]
+                yield from get_stream_events(entries, route, bbox)
+
+    last_event_id = request.headers.get("Last-Event-ID")
+    response = Response(
+        stream_with_context(generate(last_event_id)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.call_on_close(lambda: LIVE_TRAFFIC_READER.unsubscribe(subscriber))
+    return response
@@ -0,0 +1,87 @@
+"""This module provides backfilling traffic route rollups from traffic buckets."""
+
+import time
+import logging
+import argparse
+
+import pymongo
+
+from app import MONGO_DATABASE
+from app.helpers.traffic import ROLLUP_GRANULARITIES, ROLLUP_RETENTIONS, TrafficBuckets
+from app.helpers.traffic_batch import BUCKET_SIZE, SPEED_SCALE, DISTANCE_SCALE
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_rollups_pipeline(granularity, bucket_size, start, end):
+    """Return aggregation pipeline that unwinds traffic buckets samples into rollup buckets."""
+    projection = {
+        "_id": 0,
+        "route_short_name": "$_id.route_short_name",
+        "granularity": {"$literal": granularity},
+        "timestamp": "$_id.timestamp",
+        "count": 1,
+        "speed_sum": 1,
+        "distance_sum": 1,
+        "ticks": {"$size": "$ticks"}
+    }
+    if granularity in ROLLUP_RETENTIONS:
+        expire_at = {"$add": ["$_id.timestamp", ROLLUP_RETENTIONS[granularity]]}
+        projection["expire_at"] = {"$toDate": {"$multiply": [expire_at, 1000]}}
+
+    return [
+        {"$match": {"hour": {"$gte": start - start % BUCKET_SIZE, "$lte": end}}},
+        {"$project": {
+            "route_short_name": 1,
+            "hour": 1,
+            "samples": {"$zip": {"inputs": ["$t", "$spd", "$dst"]}}
+        }},
+        {"$unwind": "$samples"},
+        {"$project": {
+            "route_short_name": 1,
+            "timestamp": {"$add": ["$hour", {"$arrayElemAt": ["$samples", 0]}]},
+            "speed": {"$divide": [{"$arrayElemAt": ["$samples", 1]}, SPEED_SCALE]},
+            "distance": {"$divide": [{"$arrayElemAt": ["$samples", 2]}, DISTANCE_SCALE]}
+        }},
+        {"$match": {"timestamp": {"$gte": start, "$lte": end}}},
+        {"$group": {
+            "_id": {
+                "route_short_name": "$route_short_name",
+                "timestamp": {"$subtract": ["$timestamp", {"$mod": ["$timestamp", bucket_size]}]}
+            },
+            "count": {"$sum": 1},
+            "speed_sum": {"$sum": "$speed"},
+            "distance_sum": {"$sum": "$distance"},
+            "ticks": {"$addToSet": "$timestamp"}
+        }},
+        {"$project": projection},
+        {"$merge": {
+            "into": MONGO_DATABASE.traffic_route_rollups.name,
+            "on": ["route_short_name", "granularity", "timestamp"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }}
+    ]
+
+
+def backfill_rollups(days):
+    """Rebuild rollup buckets of every granularity from traffic buckets for last days."""
+    end = int(time.time())
+    start = end - days * 86400 if days else 0
+    for granularity, bucket_size in ROLLUP_GRANULARITIES.items():
+        bucket_start = start - start % bucket_size
+        pipeline = get_rollups_pipeline(granularity, bucket_size, bucket_start, end)
+        try:
+            TrafficBuckets.collection.aggregate(pipeline, allowDiskUse=True)
+        except pymongo.errors.PyMongoError as err:
+            LOGGER.error("Failed to backfill `%s` rollups: %s.", granularity, err)
+            continue
+
+        LOGGER.info("Rollups `%s` were successfully backfilled.", granularity)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backfill traffic route rollups.")
+    parser.add_argument("--days", type=int, default=0, help="days to backfill, all history by default")
+    backfill_rollups(parser.parse_args().days)
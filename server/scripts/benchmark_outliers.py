@@ -0,0 +1,61 @@
+"""This module provides micro-benchmark of outliers filtering functionality."""
+
+import timeit
+import logging
+import argparse
+
+import numpy as np
+
+from app.helpers import outliers
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def legacy_iqr(iterable, q1_bound=0.25, q2_bound=0.75):
+    """Previous list based iqr implementation kept as benchmark baseline."""
+    q1_value = np.quantile(iterable, q1_bound)
+    q2_value = np.quantile(iterable, q2_bound)
+
+    return list(filter(lambda x: q1_value <= x <= q2_value, iterable))
+
+
+def get_cases(size):
+    """Return benchmark cases as (name, baseline, candidate) callables."""
+    rng = np.random.default_rng(0)
+    speeds = np.abs(rng.normal(20, 8, size))
+    speeds_list = speeds.tolist()
+    speed_bins, speed_counts = np.unique(np.rint(speeds * 10), return_counts=True)
+
+    return [
+        (
+            "min speed",
+            lambda: min(legacy_iqr(speeds_list, q1_bound=0.1)),
+            lambda: outliers.quantiles(speeds, 0.1),
+        ),
+        (
+            "min speed from histogram",
+            lambda: min(legacy_iqr(speeds_list, q1_bound=0.1)),
+            lambda: outliers.weighted_quantiles(speed_bins, speed_counts, 0.1) / 10,
+        ),
+    ]
+
+
+def benchmark(size, repeat):
+    """Log best timing of legacy and vectorized implementation for every case."""
+    for name, baseline, candidate in get_cases(size):
+        baseline_time = min(timeit.repeat(baseline, number=1, repeat=repeat)) * 1000
+        candidate_time = min(timeit.repeat(candidate, number=1, repeat=repeat)) * 1000
+        LOGGER.info(
+            "%s: legacy %.2f ms, numpy %.2f ms, %.1fx speedup.",
+            name, baseline_time, candidate_time, baseline_time / candidate_time
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark outliers filtering.")
+    parser.add_argument("--size", type=int, default=1_000_000, help="count of speeds")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repeats")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    benchmark(args.size, args.repeat)
@@ -5,17 +5,23 @@ import logging
 import pymongo
 
 from app import MONGO_DATABASE
+from app.utils.mongo import STOPS_COORDINATES_INDEX_NAME, STOPS_NAMES_INDEX_NAME
 
 
 LOGGER = logging.getLogger(__name__)
 
-STOPS_COORDINATES_INDEX_NAME = "stops_coordinates_index"
-STOPS_NAMES_INDEX_NAME = "stops_names_index"
 TRAFFIC_CONGESTION_REGION_INDEX_NAME = "traffic_congestion_region_index"
 TRAFFIC_NAME_TIMESTAMP_INDEX_NAME = "traffic_name_timestamp_index"
+TRAFFIC_ROUTE_ROLLUPS_INDEX_NAME = "traffic_route_rollups_index"
+TRAFFIC_BUCKETS_ROUTE_INDEX_NAME = "traffic_buckets_route_index"
+TRAFFIC_BUCKETS_NAME_INDEX_NAME = "traffic_buckets_name_index"
+TRAFFIC_BUCKETS_HOUR_INDEX_NAME = "traffic_buckets_hour_index"
+TRAFFIC_ROUTE_ROLLUPS_TTL_INDEX_NAME = "traffic_route_rollups_ttl_index"
+TRAFFIC_CONGESTION_TTL_INDEX_NAME = "traffic_congestion_ttl_index"
+TRAFFIC_ARCHIVES_RANGE_INDEX_NAME = "traffic_archives_range_index"
 
 
-def create_index(collection, index, index_name):
+def create_index(collection, index, index_name, **kwargs):
     """Create index if not exists."""
     if index_name in collection.index_information():
         LOGGER.error(
@@ -25,7 +31,7 @@ def create_index(collection, index, index_name):
         return
 
     try:
-        result = collection.create_index(index, name=index_name)
+        result = collection.create_index(index, name=index_name, **kwargs)
         if result:
             LOGGER.info("Index `%s` was successfully created.", index_name)
         else:
@@ -40,6 +46,14 @@ def create_indexes():
         1. stops: 2d index on `coordinates`
         2. stops: text index on `stop_name` and `stop_desc`
         3. traffic_congestion: text index on `region`
+        4. traffic: index on `route_short_name` and `timestamp`
+        5. traffic_route_rollups: unique index on route bucket
+        6. traffic_buckets: unique index on `route_id` and `hour`
+        7. traffic_buckets: index on `route_short_name` and `hour`
+        8. traffic_buckets: index on `hour`
+        9. traffic_route_rollups: ttl index on `expire_at`
+        10. traffic_congestion: ttl index on `expire_at`
+        11. traffic_archives: unique index on `start` and `end`
     """
     create_index(
         collection=MONGO_DATABASE.stops,
@@ -61,6 +75,50 @@ def create_indexes():
         index=[("route_short_name", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)],
         index_name=TRAFFIC_NAME_TIMESTAMP_INDEX_NAME
     )
+    create_index(
+        collection=MONGO_DATABASE.traffic_route_rollups,
+        index=[
+            ("route_short_name", pymongo.ASCENDING),
+            ("granularity", pymongo.ASCENDING),
+            ("timestamp", pymongo.ASCENDING)
+        ],
+        index_name=TRAFFIC_ROUTE_ROLLUPS_INDEX_NAME,
+        unique=True
+    )
+    create_index(
+        collection=MONGO_DATABASE.traffic_buckets,
+        index=[("route_id", pymongo.ASCENDING), ("hour", pymongo.ASCENDING)],
+        index_name=TRAFFIC_BUCKETS_ROUTE_INDEX_NAME,
+        unique=True
+    )
+    create_index(
+        collection=MONGO_DATABASE.traffic_buckets,
+        index=[("route_short_name", pymongo.ASCENDING), ("hour", pymongo.DESCENDING)],
+        index_name=TRAFFIC_BUCKETS_NAME_INDEX_NAME
+    )
+    create_index(
+        collection=MONGO_DATABASE.traffic_buckets,
+        index=[("hour", pymongo.ASCENDING)],
+        index_name=TRAFFIC_BUCKETS_HOUR_INDEX_NAME
+    )
+    create_index(
+        collection=MONGO_DATABASE.traffic_route_rollups,
+        index=[("expire_at", pymongo.ASCENDING)],
+        index_name=TRAFFIC_ROUTE_ROLLUPS_TTL_INDEX_NAME,
+        expireAfterSeconds=0
+    )
+    create_index(
+        collection=MONGO_DATABASE.traffic_congestion,
+        index=[("expire_at", pymongo.ASCENDING)],
+        index_name=TRAFFIC_CONGESTION_TTL_INDEX_NAME,
+        expireAfterSeconds=0
+    )
+    create_index(
+        collection=MONGO_DATABASE.traffic_archives,
+        index=[("start", pymongo.ASCENDING), ("end", pymongo.ASCENDING)],
+        index_name=TRAFFIC_ARCHIVES_RANGE_INDEX_NAME,
+        unique=True
+    )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,90 @@
+"""This module provides migrating raw traffic documents into compact hourly buckets."""
+
+import time
+import logging
+import argparse
+import itertools
+
+import pymongo
+
+from app import MONGO_DATABASE
+from app.helpers.traffic import TrafficBuckets
+from app.helpers.traffic_batch import BUCKET_SIZE, TrafficBatch
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def add_route_samples(buckets, route):
+    """Append packed route samples of one tick to the route hour bucket built in memory."""
+    key = (route["route_id"], route["hour"])
+    bucket = buckets.get(key)
+    if bucket is None:
+        bucket = buckets[key] = {
+            "route_id": route["route_id"],
+            "route_short_name": route["route_short_name"],
+            "route_type": route["route_type"],
+            "hour": route["hour"],
+            "vehicles": {},
+            **{k: [] for k in route["samples"]}
+        }
+
+    for k, v in route["samples"].items():
+        bucket[k].extend(v)
+
+    bucket["vehicles"].update(dict.fromkeys(tuple(x) for x in route["vehicles"]))
+
+
+def migrate_hour(hour):
+    """
+    Pack raw traffic documents of one hour into complete route buckets and
+    replace stored ones, so rerunning migration doesn't duplicate samples.
+    """
+    cursor = MONGO_DATABASE.traffic.find(
+        filter={"timestamp": {"$gte": hour, "$lt": hour + BUCKET_SIZE}},
+        projection={"_id": 0},
+        sort=[("timestamp", pymongo.ASCENDING)]
+    )
+    buckets = {}
+    migrated = 0
+    for timestamp, documents in itertools.groupby(cursor, key=lambda x: x["timestamp"]):
+        documents = list(documents)
+        for route in TrafficBatch.from_documents(timestamp, documents).get_routes_samples():
+            add_route_samples(buckets, route)
+
+        migrated += len(documents)
+
+    for bucket in buckets.values():
+        bucket["vehicles"] = [list(x) for x in bucket["vehicles"]]
+
+    TrafficBuckets.replace(buckets.values())
+    return migrated
+
+
+def migrate_traffic(days):
+    """Migrate raw traffic for last days hour by hour, oldest first."""
+    first = MONGO_DATABASE.traffic.find_one(
+        projection={"_id": 0, "timestamp": 1},
+        sort=[("timestamp", pymongo.ASCENDING)]
+    )
+    if not first:
+        LOGGER.info("There is no raw traffic to migrate.")
+        return
+
+    end = int(time.time())
+    start = max(first["timestamp"], end - days * 86400 if days else 0)
+    for hour in range(start - start % BUCKET_SIZE, end, BUCKET_SIZE):
+        try:
+            migrated = migrate_hour(hour)
+        except pymongo.errors.PyMongoError as err:
+            LOGGER.error("Failed to migrate traffic for hour %s: %s.", hour, err)
+            continue
+
+        if migrated:
+            LOGGER.info("Migrated %s traffic documents for hour %s.", migrated, hour)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrate raw traffic into hourly buckets.")
+    parser.add_argument("--days", type=int, default=0, help="days to migrate, all history by default")
+    migrate_traffic(parser.parse_args().days)
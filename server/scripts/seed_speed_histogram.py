@@ -0,0 +1,39 @@
+"""This module provides seeding speed histogram from stored traffic."""
+
+import logging
+
+import numpy as np
+import pymongo
+
+from app import REDIS
+from app.constants import REDIS_SPEED_HISTOGRAM_KEY, REDIS_ROUTES_MIN_SPEED_KEY
+from app.helpers.traffic import SpeedHistogram, TrafficBuckets
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def seed_speed_histogram():
+    """Rebuild speed histogram from speeds of every stored traffic bucket."""
+    counts = np.zeros(SpeedHistogram.max_bin + 1, dtype=np.int64)
+    try:
+        cursor = TrafficBuckets.collection.find(projection={"_id": 0, "spd": 1}, batch_size=100)
+        for bucket in cursor:
+            bins = np.minimum(np.asarray(bucket["spd"], dtype=np.int64), SpeedHistogram.max_bin)
+            counts += np.bincount(bins[bins > 0], minlength=len(counts))
+    except pymongo.errors.PyMongoError as err:
+        LOGGER.error("Failed to read traffic speeds: %s.", err)
+        return
+
+    histogram = {speed_bin: int(counts[speed_bin]) for speed_bin in np.flatnonzero(counts).tolist()}
+    pipeline = REDIS.pipeline()
+    pipeline.delete(REDIS_SPEED_HISTOGRAM_KEY, REDIS_ROUTES_MIN_SPEED_KEY)
+    if histogram:
+        pipeline.hset(REDIS_SPEED_HISTOGRAM_KEY, mapping=histogram)
+    pipeline.execute()
+
+    LOGGER.info("Speed histogram was seeded with %s speeds.", int(counts.sum()))
+
+
+if __name__ == '__main__':
+    seed_speed_histogram()
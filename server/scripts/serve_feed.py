@@ -0,0 +1,82 @@
+"""This module provides local http stand-in serving recorded GTFS realtime feeds."""
+
+import os
+import time
+import hashlib
+import logging
+import argparse
+import itertools
+from http import HTTPStatus
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def load_feeds(directory):
+    """Return recorded protobuf feeds from directory sorted by file name."""
+    feeds = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".pb"):
+            continue
+
+        with open(os.path.join(directory, filename), "rb") as file:
+            content = file.read()
+
+        feeds.append((content, hashlib.sha1(content).hexdigest()))
+
+    return feeds
+
+
+def create_handler(feeds, interval):
+    """Return request handler that rotates recorded feeds every interval seconds."""
+    feeds_cycle = itertools.cycle(feeds)
+    state = {"feed": next(feeds_cycle), "changed": time.time()}
+
+    class FeedHandler(BaseHTTPRequestHandler):
+        """Request handler serving current feed with ETag and Last-Modified headers."""
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """Serve current recorded feed or 304 if client already has it."""
+            if time.time() - state["changed"] >= interval:
+                state["feed"] = next(feeds_cycle)
+                state["changed"] = time.time()
+
+            content, etag = state["feed"]
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.end_headers()
+                return
+
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", "application/x-protobuf")
+            self.send_header("Content-Length", str(len(content)))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", formatdate(state["changed"], usegmt=True))
+            self.end_headers()
+            self.wfile.write(content)
+
+    return FeedHandler
+
+
+def serve_feed(directory, port, interval):
+    """Serve recorded feeds from directory, point GTFS_VEHICLE_URL to it."""
+    feeds = load_feeds(directory)
+    if not feeds:
+        LOGGER.error("Couldn't find recorded *.pb feeds in %s.", directory)
+        return
+
+    server = ThreadingHTTPServer(("localhost", port), create_handler(feeds, interval))
+    LOGGER.info("Serving %s recorded feeds at http://localhost:%s/", len(feeds), port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Serve recorded GTFS realtime feeds.")
+    parser.add_argument("directory", help="directory with recorded *.pb feeds")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--interval", type=float, default=30, help="seconds before next feed")
+    args = parser.parse_args()
+    serve_feed(args.directory, args.port, args.interval)
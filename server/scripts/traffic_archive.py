@@ -0,0 +1,167 @@
+"""This module provides parallel time partitioned export and import of traffic."""
+
+import os
+import glob
+import gzip
+import json
+import time
+import logging
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pymongo
+
+from app import APP_CONFIG, MONGO_DATABASE
+from app.utils.misc import chunked
+from app.utils.time import DATE_FORMAT
+from app.helpers.traffic import TrafficBuckets
+from app.helpers.traffic_batch import BUCKET_SIZE
+
+
+LOGGER = logging.getLogger(__name__)
+
+PARTITION_HOURS = 24
+PARTITION_FILE_FORMAT = "traffic_{start}_{end}.ndjson.gz"
+CURSOR_BATCH_SIZE = 100
+INSERT_BATCH_SIZE = 500
+DUPLICATE_KEY_ERROR = 11000
+
+WORKER_COLLECTION = None
+
+
+def init_worker():
+    """Open independent mongo connection for worker process."""
+    global WORKER_COLLECTION  # pylint: disable=global-statement
+    client = pymongo.MongoClient(
+        APP_CONFIG.MONGO_URI,
+        serverSelectionTimeoutMS=APP_CONFIG.MONGO_SERVER_TIMEOUT
+    )
+    WORKER_COLLECTION = client[MONGO_DATABASE.name][TrafficBuckets.collection.name]
+
+
+def get_partitions(start, end, partition_hours):
+    """Split time range into partitions aligned to traffic buckets."""
+    size = partition_hours * BUCKET_SIZE
+    start -= start % BUCKET_SIZE
+    return [(x, min(x + size, end)) for x in range(start, end, size)]
+
+
+def export_partition(directory, start, end):
+    """Write traffic buckets of partition into compressed ndjson file."""
+    cursor = WORKER_COLLECTION.find(
+        filter={"hour": {"$gte": start, "$lt": end}},
+        projection={"_id": 0},
+        sort=[("hour", pymongo.ASCENDING)],
+        batch_size=CURSOR_BATCH_SIZE
+    )
+    path = os.path.join(directory, PARTITION_FILE_FORMAT.format(start=start, end=end))
+    samples = 0
+    with gzip.open(f"{path}.part", "wt", encoding="utf-8") as file:
+        for bucket in cursor:
+            file.write(json.dumps(bucket, ensure_ascii=False))
+            file.write("\n")
+            samples += len(bucket["t"])
+
+    os.replace(f"{path}.part", path)
+    return path, samples, os.path.getsize(path)
+
+
+def import_partition(path):
+    """Load traffic buckets from compressed ndjson file by unordered batches."""
+    samples = 0
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        for lines in chunked(file, INSERT_BATCH_SIZE):
+            buckets = [json.loads(line) for line in lines]
+            try:
+                WORKER_COLLECTION.insert_many(buckets, ordered=False)
+            except pymongo.errors.BulkWriteError as err:
+                # buckets that are already stored are skipped, so import can be repeated
+                errors = [x for x in err.details["writeErrors"] if x["code"] != DUPLICATE_KEY_ERROR]
+                if errors:
+                    raise
+
+            samples += sum(len(bucket["t"]) for bucket in buckets)
+
+    return path, samples, os.path.getsize(path)
+
+
+def run_partitions(func, partitions, workers):
+    """Run partitions in process pool reporting progress and throughput."""
+    started = time.time()
+    total_samples = total_size = 0
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        futures = {executor.submit(func, *partition): partition for partition in partitions}
+        for index, future in enumerate(as_completed(futures), 1):
+            try:
+                path, samples, size = future.result()
+            except (pymongo.errors.PyMongoError, OSError, ValueError) as err:
+                LOGGER.error("Partition %s failed: %s", futures[future], err)
+                failed.append(futures[future])
+                continue
+
+            total_samples += samples
+            total_size += size
+            elapsed = max(time.time() - started, 1e-6)
+            LOGGER.info(
+                "[%s/%s] %s: %s samples. Total: %s samples, %.1f MB, %.0f samples/s, %.1f MB/s",
+                index, len(partitions), os.path.basename(path), samples,
+                total_samples, total_size / 2 ** 20,
+                total_samples / elapsed, total_size / 2 ** 20 / elapsed
+            )
+
+    LOGGER.info(
+        "Processed %s partitions in %.1f s, %s failed.",
+        len(partitions), time.time() - started, len(failed)
+    )
+    return failed
+
+
+def export_traffic(directory, start, end, workers, partition_hours):
+    """Export traffic buckets for date range into per partition files."""
+    os.makedirs(directory, exist_ok=True)
+    partitions = get_partitions(start, end, partition_hours)
+    return run_partitions(
+        export_partition,
+        [(directory, x, y) for x, y in partitions],
+        workers
+    )
+
+
+def import_traffic(directory, workers):
+    """Import traffic buckets from partition files in directory."""
+    paths = sorted(glob.glob(os.path.join(directory, PARTITION_FILE_FORMAT.format(start="*", end="*"))))
+    return run_partitions(import_partition, [(x,) for x in paths], workers)
+
+
+def parse_date(value):
+    """Return timestamp of the date beginning."""
+    return int(datetime.strptime(value, DATE_FORMAT).timestamp())
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    parser = argparse.ArgumentParser(description="Parallel export and import of traffic archives.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="count of worker processes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="export traffic into partition files")
+    export_parser.add_argument("directory", help="directory for partition files")
+    export_parser.add_argument("--start", type=parse_date, required=True, help=f"first day, {DATE_FORMAT}")
+    export_parser.add_argument("--end", type=parse_date, required=True, help=f"last day, {DATE_FORMAT}")
+    export_parser.add_argument("--partition-hours", type=int, default=PARTITION_HOURS, help="hours per partition")
+
+    import_parser = subparsers.add_parser("import", help="import traffic from partition files")
+    import_parser.add_argument("directory", help="directory with partition files")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        end = args.end + int(timedelta(days=1).total_seconds())
+        failed_partitions = export_traffic(args.directory, args.start, end, args.workers, args.partition_hours)
+    else:
+        failed_partitions = import_traffic(args.directory, args.workers)
+
+    if failed_partitions:
+        raise SystemExit(1)